@@ -1,5 +1,15 @@
 from adapter.retriever import DocumentRetriever
 from adapter.llm import LlmService
+from common.semantic_cache import SemanticCache
+from config import config
 
 document_retriever = DocumentRetriever()
 llm_service = LlmService()
+
+semantic_cache = SemanticCache(
+    threshold=config.semantic_cache.threshold,
+    max_entries=config.semantic_cache.max_entries,
+    ttl_seconds=config.semantic_cache.ttl_seconds,
+)
+# cached answers are stale as soon as their collection changes
+document_retriever.add_collection_listener(semantic_cache.invalidate)
@@ -0,0 +1,140 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+from common import vector_utils
+from common.lexical_index import LexicalIndex
+from common.manifest import SourceManifest
+
+
+class CollectionHandle:
+    """
+    Everything needed to serve one collection: its Chroma vector store, BM25
+    index and source manifest.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        vector_store,
+        lexical_index: LexicalIndex,
+        manifest: SourceManifest,
+    ):
+        self.name = name
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.manifest = manifest
+
+        self._lexical_index_ready = False
+        self._lexical_index_lock = threading.Lock()
+
+    def ensure_lexical_index(self, page_size: int = 1000):
+        """
+        Index the chunks stored before the BM25 index existed, once per handle:
+        an empty index of a non-empty collection is filled from the vector store.
+
+        :param page_size: chunks read from the vector store at once.
+        :return:
+        """
+        if self._lexical_index_ready:
+            return
+
+        with self._lexical_index_lock:
+            if self._lexical_index_ready:
+                return
+
+            if not self.lexical_index.count() and self.vector_store._collection.count():
+                indexed = 0
+                while True:
+                    result = self.vector_store.get(
+                        include=["documents"], limit=page_size, offset=indexed
+                    )
+                    if not result["ids"]:
+                        break
+                    self.lexical_index.add(result["ids"], result["documents"])
+                    indexed += len(result["ids"])
+                print(
+                    f"BM25 index of collection {self.name} filled with {indexed} chunks."
+                )
+
+            self._lexical_index_ready = True
+
+
+class CollectionRegistry:
+    """
+    Lazily opened collection handles sharing one vector store client and one
+    embedding model.
+
+    At most max_open handles are kept; the least recently used one is dropped
+    first. A dropped handle still referenced by a running search or ingestion
+    is reused instead of reopened, so a collection never has two manifests.
+    """
+
+    def __init__(self, data_path: str, embedding_model, max_open: int):
+        """
+        :param data_path: directory of the vector store, manifests and indexes.
+        :param embedding_model: embedding model shared by all the collections.
+        :param max_open: maximum number of handles kept open.
+        """
+        self.data_path = data_path
+        self.embedding_model = embedding_model
+        self.max_open = max_open
+
+        self.client = vector_utils.get_vector_store_client(data_path)
+
+        self._handles = OrderedDict()
+        self._live_handles = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, name: str, create: bool = True) -> CollectionHandle:
+        """
+        Handle of a collection, opened on first use.
+
+        :param name:
+        :param create: create the collection if it does not exist, else raise.
+        :return:
+        """
+        with self._lock:
+            handle = self._handles.get(name) or self._live_handles.get(name)
+            if handle is None:
+                if not create and not self.exists(name):
+                    raise ValueError(f"Collection not found: {name}")
+                handle = self._open(name)
+                self._live_handles[name] = handle
+
+            self._handles[name] = handle
+            self._handles.move_to_end(name)
+
+            while len(self._handles) > self.max_open:
+                evicted_name, _ = self._handles.popitem(last=False)
+                print(f"Collection {evicted_name} closed.")
+
+            return handle
+
+    def list_collections(self):
+        return self.client.list_collections()
+
+    def exists(self, name: str) -> bool:
+        return any(
+            collection.name == name for collection in self.client.list_collections()
+        )
+
+    def _open(self, name: str) -> CollectionHandle:
+        print(f"Collection {name} opened.")
+
+        return CollectionHandle(
+            name=name,
+            vector_store=vector_utils.get_vector_store(
+                data_path=self.data_path,
+                embedding_model=self.embedding_model,
+                collection_name=name,
+                client=self.client,
+            ),
+            lexical_index=LexicalIndex(
+                os.path.join(self.data_path, "lexical", f"{name}.sqlite3")
+            ),
+            manifest=SourceManifest(
+                os.path.join(self.data_path, "manifests", f"{name}.json")
+            ),
+        )
@@ -1,6 +1,9 @@
+import asyncio
+import threading
 from typing import List
 
 from common import llm_utils
+from common.context_packer import ContextPacker
 from config import config
 
 from langchain_core.messages import AnyMessage, SystemMessage
@@ -11,6 +14,9 @@ from langchain_core.prompts import PromptTemplate
 class LlmService:
     def __init__(self):
         self.llm = None
+        self.admission = None
+        self.context_packer = None
+        self._context_packer_lock = threading.Lock()
 
         template = """
         You are a helpful assistant. 
@@ -33,6 +39,35 @@ class LlmService:
         """
         QA the LLM
 
+        :param messages:
+        :return:
+        """
+        prompt = self._build_prompt(messages)
+
+        print(f"Getting Answer from LLM: {prompt}")
+        with self.admission.slot():
+            return self.llm.invoke(prompt)
+
+    async def agenerate_response(self, messages: List[AnyMessage]):
+        """
+        QA the LLM asynchronously
+
+        :param messages:
+        :return:
+        """
+        # the tokenizer may be downloaded on first use, off the event loop
+        if self.context_packer is None:
+            await asyncio.to_thread(self._get_context_packer)
+        prompt = self._build_prompt(messages)
+
+        print(f"Getting Answer from LLM: {prompt}")
+        async with self.admission.aslot():
+            return await self.llm.ainvoke(prompt)
+
+    def _build_prompt(self, messages: List[AnyMessage]):
+        """
+        Form the prompt from the retrieved context and the conversation.
+
         :param messages:
         :return:
         """
@@ -47,10 +82,17 @@ class LlmService:
 
         chat_messages = recent_messages[::-1]
 
-        # Format into prompt
-        chat_content = "\n\n".join(
-            chat_message.content for chat_message in chat_messages
-        )
+        # Pack the retrieved documents into the context budget
+        documents = []
+        for chat_message in chat_messages:
+            documents += chat_message.artifact or []
+
+        if documents:
+            chat_content = self._get_context_packer().pack(documents)
+        else:
+            chat_content = "\n\n".join(
+                chat_message.content for chat_message in chat_messages
+            )
         message_context = self.prompt_template.invoke({"context": chat_content})
 
         # get conversation messages
@@ -62,15 +104,37 @@ class LlmService:
         ]
 
         # form the prompt to send to llm
-        prompt = [SystemMessage(message_context.to_string())] + conversation_messages
-
-        print(f"Getting Answer from LLM: {prompt}")
-        return self.llm.invoke(prompt)
+        return [SystemMessage(message_context.to_string())] + conversation_messages
+
+    def _get_context_packer(self) -> ContextPacker:
+        # the tokenizer is loaded on first use, once
+        with self._context_packer_lock:
+            if self.context_packer is None:
+                self.context_packer = ContextPacker(
+                    count_tokens=llm_utils.get_token_counter(
+                        config.llms.llm_type, config.llms.llm_name
+                    ),
+                    max_tokens=config.llms.context_max_tokens,
+                    duplicate_threshold=config.llms.context_duplicate_threshold,
+                )
+
+            return self.context_packer
 
     def init_llm(self):
+        # bound the calls running at once against the backend
+        self.admission = llm_utils.get_admission_controller(
+            backend="llm",
+            backend_type=config.llms.llm_type,
+            max_concurrent=config.llms.max_concurrent,
+            max_waiting=config.llms.max_waiting,
+            max_wait_seconds=config.llms.max_wait_seconds,
+        )
+
         # Initialize the language model (OpenAI for QA)
         self.llm = llm_utils.get_llm(
             llm_type=config.llms.llm_type,
             model_name=config.llms.llm_name,
             local_server=config.llms.local_server,
+            max_connections=self.admission.max_concurrent,
         )
+        self.context_packer = None
@@ -1,8 +1,24 @@
-import math
+import contextlib
+import hashlib
+import heapq
+import os
 import asyncio
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable
 
+import numpy as np
+
+from adapter.collection_registry import CollectionHandle, CollectionRegistry
 from common import vector_utils, llm_utils
+from common.admission import AdmissionRejected
+from common.embedding_batcher import MicroBatchedEmbeddings
+from common.retrieval_cache import RetrievalCache
+from common.singleflight import SingleFlight
 from config import config
+from domain.model import IngestJob
 from langchain_core.documents import Document
 
 
@@ -13,144 +29,985 @@ class DocumentRetriever:
         : param config: the configuration setup.
         """
 
-        self.vector_store_retriever = None
-        self.vector_store = None
+        # collection used by the requests that do not name one
+        self.default_collection = "default"
+        self.reranker = None
+
+        self.workers = []
+        self.queue = asyncio.Queue()  # Queue to hold ingestion jobs
+        self.jobs = OrderedDict()  # job id -> IngestJob, oldest first
+        # jobs re-ingesting the same source of a collection run one after the other
+        self.source_locks = defaultdict(asyncio.Lock)
+        self.collection_listeners = []
+
+        # per-collection generation, advanced whenever the collection content changes
+        self.generations = defaultdict(int)
+        self.collection_sizes = {}  # collection -> (generation, number of chunks)
+        self.retrieval_cache = RetrievalCache(config.retrieval.cache_max_entries)
+        # identical searches running at the same time share one search
+        self.retrieval_flights = SingleFlight()
+        # collection -> search still running in the executor after its timeout
+        self.stalled_searches = {}
+
+        # bounded executor for the blocking query embedding and vector search
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.embeddings.executor_workers,
+            thread_name_prefix="retriever",
+        )
 
-        self.worker_task = None
-        self.isProcessing = False
-        self.queue = asyncio.Queue()  # Queue to hold documents
+        # bound the embedding calls running at once against the backend
+        self.embedding_admission = llm_utils.get_admission_controller(
+            backend="embeddings",
+            backend_type=config.embeddings.embedding_type,
+            max_concurrent=config.embeddings.max_concurrent,
+            max_waiting=config.embeddings.max_waiting,
+            max_wait_seconds=config.embeddings.max_wait_seconds,
+        )
 
-        self.embedding_model = llm_utils.get_embedding_model(
-            config.embeddings.embedding_type, config.embeddings.embedding_model
+        if config.embeddings.cache_enabled:
+            self.embedding_model = llm_utils.get_cached_embedding_model(
+                embedding_type=config.embeddings.embedding_type,
+                embedding_model=config.embeddings.embedding_model,
+                cache_path=os.path.join(
+                    config.vector_store.data_path, "embedding_cache.sqlite3"
+                ),
+                memory_items=config.embeddings.cache_memory_items,
+                max_entries=config.embeddings.cache_max_entries,
+                admission=self.embedding_admission,
+                query_batch_size=config.embeddings.query_batch_size,
+                query_batch_wait_ms=config.embeddings.query_batch_wait_ms,
+            )
+        else:
+            self.embedding_model = llm_utils.get_embedding_model(
+                config.embeddings.embedding_type,
+                config.embeddings.embedding_model,
+                admission=self.embedding_admission,
+                query_batch_size=config.embeddings.query_batch_size,
+                query_batch_wait_ms=config.embeddings.query_batch_wait_ms,
+            )
+
+        # ingestion batches sized for the embedding backend
+        self.batch_limits = llm_utils.get_embedding_batch_limits(
+            config.embeddings.embedding_type,
+            max_chunks=config.embeddings.batch_max_chunks,
+            max_chars=config.embeddings.batch_max_chars,
+            concurrency=config.embeddings.batch_concurrency,
         )
+        # batches embedded and written at once, shared by all the ingestion jobs
+        self.write_semaphore = asyncio.Semaphore(self.batch_limits["concurrency"])
 
-        # setup vector_store, retriever, llm
+        # collections are opened on first use and share the client and embeddings
+        self.registry = CollectionRegistry(
+            data_path=config.vector_store.data_path,
+            embedding_model=self.embedding_model,
+            max_open=config.vector_store.max_open_collections,
+        )
         self.get_or_create_collection()
 
     async def _worker(self):
-        """Worker task that processes batches of documents from the queue."""
-        while self.isProcessing:
-            # Get the next batch of documents from the queue
-            task = await self.queue.get()
-            if task is None:
-                self.isProcessing = False
-
-            documents = task  # Unpack the tuple
-            await self._process_document(documents)
-
-            self.queue.task_done()
-
-    async def _start_worker(self):
-        """Start a worker to process documents from the queue."""
-        if not self.worker_task or self.worker_task.done():
-            self.worker_task = asyncio.create_task(self._worker())
-
-        return self.worker_task
-
-    async def add_documents(self, documents: list[Document]):
-        """Add documents to the queue for processing."""
-        self.isProcessing = True
-        print(f"Adding to queue: {len(documents)} documents.")
-        await self.queue.put(documents)
+        """Worker task that processes ingestion jobs from the queue."""
+        while True:
+            job, documents, digest = await self.queue.get()
+
+            try:
+                async with self.source_locks[(job.collection, job.source)]:
+                    await self._process_document(documents, digest, job)
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e) or repr(e)
+                print(f"Ingestion job {job.id} failed: {e!r}")
+            finally:
+                job.finished_at = time.time()
+                self.queue.task_done()
+
+    def _start_workers(self):
+        """Keep the configured number of workers running."""
+        self.workers = [worker for worker in self.workers if not worker.done()]
+
+        while len(self.workers) < config.ingestion.workers:
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    async def add_documents(
+        self,
+        documents: AsyncIterable[Document] | list[Document],
+        digest: str = None,
+        collection_name: str = None,
+        source: str = "",
+    ) -> IngestJob:
+        """
+        Add documents to the queue for processing.
+
+        :param documents: chunks, usually streamed by one of the loaders.
+        :param digest: content digest of the ingested file, if any.
+        :param collection_name: target collection, defaults to the default collection.
+        :param source: file path or url the chunks come from.
+        :return: the queued job.
+        """
+        job = IngestJob(
+            id=uuid.uuid4().hex,
+            # resolved now, so switching the default later does not redirect the job
+            collection=collection_name or self.default_collection,
+            source=self.get_source(source),
+            created_at=time.time(),
+        )
+        self._remember_job(job)
+
+        await self.queue.put((job, documents, digest))
+        print(f"Queued ingestion job {job.id}. Total jobs are {self.queue.qsize()}")
+
+        self._start_workers()
+
+        return job
+
+    def get_job(self, job_id: str) -> IngestJob:
+        return self.jobs.get(job_id)
+
+    def _remember_job(self, job: IngestJob):
+        self.jobs[job.id] = job
+
+        # forget the oldest finished jobs
+        excess = len(self.jobs) - config.ingestion.max_jobs_kept
+        if excess <= 0:
+            return
+
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.state in ("done", "failed")
+        ]
+        for job_id in finished[:excess]:
+            del self.jobs[job_id]
+
+    def get_source(self, path: str) -> str:
+        """
+        Source name of a path as stored in the chunk metadata.
+
+        :param path:
+        :return:
+        """
+        return path.replace(f"{config.vector_store.resource_path}/", "", 1)
+
+    def is_source_unchanged(
+        self, path: str, digest: str, collection_name: str = None
+    ) -> bool:
+        """
+        Check if a file was already ingested into the collection with the same content.
+
+        :param path:
+        :param digest:
+        :param collection_name:
+        :return:
+        """
+        manifest = self.get_collection(collection_name, create=True).manifest
+        return manifest.is_unchanged(self.get_source(path), digest)
+
+    def get_collection(
+        self, collection_name: str = None, create: bool = False
+    ) -> CollectionHandle:
+        """
+        Handle of a collection, the default one if no name is given.
+
+        Only ingestion and switching the default create collections: searching an
+        unknown one raises a ValueError instead of leaving an empty one on disk.
+
+        :param collection_name:
+        :param create: create the collection if it does not exist.
+        :return:
+        """
+        return self.registry.get(
+            collection_name or self.default_collection, create=create
+        )
+
+    async def _process_document(
+        self,
+        documents: AsyncIterable[Document] | list[Document],
+        digest: str,
+        job: IngestJob,
+    ):
+        """
+        Add new or changed chunks to the vector store and delete the ones that
+        disappeared from their source.
+
+        Parsing and embedding run concurrently: chunks are passed in batches through
+        a bounded queue, so the loader waits whenever embedding falls behind.
+
+        :param documents: chunks, usually streamed by one of the loaders.
+        :param digest: content digest of the ingested file, if any.
+        :param job: the job, updated with the progress of the ingestion.
+        :return:
+        """
+        collection = self.get_collection(job.collection, create=True)
+        # index the existing chunks before the new ones make the index non-empty
+        await asyncio.to_thread(collection.ensure_lexical_index)
+        job.state = "parsing"
+        job.started_at = time.time()
+        batches = asyncio.Queue(maxsize=config.ingestion.queue_size)
+        producer = asyncio.create_task(self._produce_batches(documents, batches))
+
+        started = time.perf_counter()
+        first_chunk_time = None
+        known_ids = {}  # source -> ids stored before this ingestion
+        seen_ids = {}  # source -> ids produced by this ingestion
+        added_ids = {}  # source -> ids added by this ingestion
+        writes = set()  # batch writes in flight
+
+        try:
+            while (batch := await batches.get()) is not None:
+                new_documents = []
+
+                job.chunks_parsed += len(batch)
+
+                for doc in batch:
+                    source = self.get_source(doc.metadata.get("source"))
+                    doc.metadata["source"] = source
+                    doc.id = self._chunk_id(source, doc)
+                    doc.metadata["id"] = doc.id
+
+                    if source not in known_ids:
+                        known_ids[source] = self._get_known_ids(collection, source)
+                        seen_ids[source] = set()
+                        added_ids[source] = set()
+
+                    # identical chunks within a source are stored once
+                    if doc.id in seen_ids[source]:
+                        continue
+                    seen_ids[source].add(doc.id)
+
+                    if doc.id not in known_ids[source]:
+                        new_documents.append(doc)
+
+                # Add documents to the vector store, a bounded number of batches at once
+                for write_batch in self._split_batches(new_documents):
+                    await self.write_semaphore.acquire()
+                    writes.add(
+                        asyncio.create_task(self._write_batch(collection, write_batch))
+                    )
+                    self._collect_writes(writes, added_ids)
+                job.chunks_added = sum(len(ids) for ids in added_ids.values())
+
+                if first_chunk_time is None and job.chunks_added:
+                    first_chunk_time = time.perf_counter() - started
+                    job.searchable_after_seconds = round(first_chunk_time, 3)
+                    print(f"First chunks searchable after {first_chunk_time:.2f}s.")
+
+            # parsing is over, wait for the batches still being embedded
+            job.state = "embedding"
+            if writes:
+                await asyncio.wait(writes)
+            self._collect_writes(writes, added_ids)
+            job.chunks_added = sum(len(ids) for ids in added_ids.values())
+
+            # surface loader errors before touching stale chunks
+            await producer
+        except BaseException:
+            producer.cancel()
+
+            # record the batches that still made it
+            if writes:
+                await asyncio.wait(writes)
+            with contextlib.suppress(Exception):
+                self._collect_writes(writes, added_ids)
+            job.chunks_added = sum(len(ids) for ids in added_ids.values())
+
+            # keep what was added, but never delete chunks of a partial parse
+            for source in known_ids:
+                collection.manifest.update(
+                    source, known_ids[source] | added_ids[source]
+                )
+            collection.manifest.save()
+            raise
+
+        # delete the stale chunks and record the sources
+        job.state = "writing"
+        for source in known_ids:
+            stale_ids = list(known_ids[source] - seen_ids[source])
+            job.chunks_stale += len(stale_ids)
+            job.chunks_unchanged += len(seen_ids[source] & known_ids[source])
+            print(
+                f"Source {source}: {len(added_ids[source])} added, {len(stale_ids)} stale, "
+                f"{len(seen_ids[source] & known_ids[source])} unchanged chunks."
+            )
+
+            if stale_ids:
+                await collection.vector_store.adelete(ids=stale_ids)
+                await asyncio.to_thread(collection.lexical_index.delete, stale_ids)
+                self._bump_generation(collection.name)
+
+            collection.manifest.update(
+                source,
+                (known_ids[source] & seen_ids[source]) | added_ids[source],
+                digest,
+            )
+
+        collection.manifest.save()
+
+        elapsed = time.perf_counter() - started
+        job.chunks_per_second = round(job.chunks_added / elapsed, 1)
+        job.state = "done"
         print(
-            f"Queued  {len(documents)} chunks to the queue. Total documents are {self.queue.qsize()}"
+            f"Ingested {job.chunks_added} chunks into collection {collection.name} in "
+            f"{elapsed:.2f}s ({job.chunks_per_second} chunks/sec)."
         )
 
-        # Start the worker
-        if not self.worker_task:
-            asyncio.create_task(self._start_worker())  # Start worker in the background
+    async def _produce_batches(
+        self,
+        documents: AsyncIterable[Document] | list[Document],
+        batches: asyncio.Queue,
+    ):
+        """
+        Feed the chunks to the bounded batch queue, ending with a None sentinel.
 
-    async def _process_document(self, documents: list[Document]):
+        :param documents:
+        :param batches:
+        :return:
         """
-        Add documents to the vector store and persist accordingly.
+        batch = []
+
+        try:
+            if isinstance(documents, list):
+                for doc in documents:
+                    batch.append(doc)
+                    if len(batch) >= config.ingestion.stream_batch_size:
+                        await batches.put(batch)
+                        batch = []
+            else:
+                async for doc in documents:
+                    batch.append(doc)
+                    if len(batch) >= config.ingestion.stream_batch_size:
+                        await batches.put(batch)
+                        batch = []
+
+            if batch:
+                await batches.put(batch)
+        except Exception:
+            # wake up the consumer, which re-raises when awaiting the producer
+            await batches.put(None)
+            raise
+
+        await batches.put(None)
+
+    def _chunk_id(self, source: str, doc: Document) -> str:
+        """
+        Content-hash id of a chunk, prefixed with its source (and page for PDFs).
+
+        :param source:
+        :param doc:
+        :return:
+        """
+        if source.lower().endswith(".pdf"):
+            page = doc.metadata.get("page")
+            page_id = f"{source}:{page}"
+        else:
+            page_id = f"{source}"
+
+        content_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+        return f"{page_id}:{content_hash[:16]}"
+
+    def _get_known_ids(self, collection: CollectionHandle, source: str) -> set[str]:
+        if source in collection.manifest.sources:
+            return set(collection.manifest.get_ids(source))
+
+        # chunks stored before the manifest existed are replaced as stale
+        return set(
+            collection.vector_store.get(where={"source": source}, include=[])["ids"]
+        )
+
+    def _split_batches(self, documents: list[Document]):
+        """
+        Split chunks into batches within the chunk count and character budget of
+        the embedding backend.
 
         :param documents:
         :return:
         """
-        # generate ids (PDF only)
-        last_page_id = None
-        page_index = 0
-        stripped_path = f"{config.vector_store.resource_path}/"
+        batch = []
+        batch_chars = 0
 
         for doc in documents:
-            source: str = doc.metadata.get("source").replace(stripped_path, "", 1)
-
-            if source.lower().endswith(".pdf"):
-                page = doc.metadata.get("page")
-                page_id = f"{source}:{page}"
-            else:
-                page_id = f"{source}"
+            doc_chars = len(doc.page_content)
+            if batch and (
+                len(batch) >= self.batch_limits["max_chunks"]
+                or batch_chars + doc_chars > self.batch_limits["max_chars"]
+            ):
+                yield batch
+                batch = []
+                batch_chars = 0
+
+            batch.append(doc)
+            batch_chars += doc_chars
+
+        if batch:
+            yield batch
+
+    async def _write_batch(self, collection: CollectionHandle, documents):
+        """
+        Embed a batch, then upsert it with its vectors into the vector store and
+        the BM25 index. Each step is retried with backoff.
 
-            if page_id == last_page_id:
-                page_index += 1
-            else:
-                page_index = 0
+        Releases a write semaphore slot acquired by the caller.
 
-            last_page_id = page_id
+        :param collection:
+        :param documents:
+        :return: the documents written.
+        """
+        try:
+            ids = [doc.id for doc in documents]
+            texts = [doc.page_content for doc in documents]
+
+            embeddings = await self._retry(self.embedding_model.embed_documents, texts)
+            await self._retry(
+                collection.vector_store._collection.upsert,
+                ids=ids,
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=[doc.metadata for doc in documents],
+            )
+            await self._retry(collection.lexical_index.add, ids, texts)
+        finally:
+            self.write_semaphore.release()
 
-            doc.metadata["source"] = source
-            doc.id = f"{page_id}:{page_index}"
-            doc.metadata["id"] = doc.id
+        print(
+            f"Batch of {len(documents)} chunks added on collection {collection.name}."
+        )
+        self._bump_generation(collection.name)
 
-        # Add documents to the vector store
-        await self._add_documents_in_batches(documents)
+        return documents
 
-    async def _add_documents_in_batches(self, documents, batch_size=10):
-        print(f"Total chunks to add: {len(documents)}")
-        # Split the documents into batches
-        num_batches = math.ceil(len(documents) / batch_size)
-        print(f"Total batches to add: {num_batches}")
+    async def _retry(self, function, *args, **kwargs):
+        """
+        Run a blocking call in a thread, retrying with exponential backoff.
 
-        for i in range(num_batches):
-            start = i * batch_size
-            end = start + batch_size
-            batch = documents[start:end]
+        :param function:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        attempts = config.embeddings.retry_attempts + 1
 
+        for attempt in range(attempts):
             try:
-                # Add the batch of documents asynchronously
+                return await asyncio.to_thread(function, *args, **kwargs)
+            except Exception as e:
+                if attempt + 1 == attempts:
+                    raise
+
+                delay = config.embeddings.retry_backoff_seconds * 2**attempt
+                if isinstance(e, AdmissionRejected):
+                    delay = max(delay, e.retry_after)
                 print(
-                    f"Adding batch {i + 1}/{num_batches} with {len(batch)} chunks on collection {self.vector_store._collection_name}."
+                    f"{function.__name__} failed ({e}), attempt {attempt + 1}/{attempts}, "
+                    f"retrying in {delay:.1f}s."
                 )
+                await asyncio.sleep(delay)
 
-                await self.vector_store.aadd_documents(batch)
-                print(f"Batch {i + 1}/{num_batches} with {len(batch)} chunks added.")
-            except Exception as e:
-                print(f"Exception: {e}")
+    def _collect_writes(self, writes: set, added_ids: dict):
+        """
+        Record the chunks of the finished batch writes, then raise the first failure.
+
+        :param writes: batch write tasks, the finished ones are removed.
+        :param added_ids: source -> ids added by the ingestion.
+        :return:
+        """
+        error = None
+
+        for task in [task for task in writes if task.done()]:
+            writes.discard(task)
+            if task.cancelled():
+                continue
+            if task.exception():
+                error = error or task.exception()
+                continue
+
+            for doc in task.result():
+                added_ids[doc.metadata["source"]].add(doc.id)
+
+        if error:
+            raise error
+
+    def add_collection_listener(self, listener):
+        """
+        Register a callback called with the collection name whenever its content changes.
 
-        print("Document batches added.")
+        :param listener:
+        :return:
+        """
+        self.collection_listeners.append(listener)
+
+    def _bump_generation(self, collection_name: str):
+        """
+        Advance the generation of a collection, invalidating cached results, and
+        notify the listeners.
 
-    def retrieve(self, query: str):
+        :param collection_name:
+        :return:
+        """
+        self.generations[collection_name] += 1
+
+        for listener in self.collection_listeners:
+            listener(collection_name)
+
+    def retrieve(
+        self,
+        query: str,
+        k: int = None,
+        filters: dict = None,
+        collection_name: str = None,
+    ):
         """
         Search the vector store.
 
+        :param query:
+        :param k: number of documents, defaults to the configured k.
+        :param filters: metadata filter passed to the vector store.
+        :param collection_name: collection to search, defaults to the default collection.
         :return:
         """
+        k = k or config.retrieval.k
+        collection = self.get_collection(collection_name)
+        collection_name = collection.name
+        cache_key = self.retrieval_cache.key(collection_name, query, k, filters)
+
+        # read the generation first: a result racing an ingestion is never reused
+        generation = self.generations[collection_name]
+        documents = self.retrieval_cache.get(cache_key, generation)
+        if documents is not None:
+            return documents
+
+        # over-fetch candidates for the diversity / rerank stage
+        fetch_k = k
+        if config.retrieval.mmr_enabled or config.retrieval.rerank_model:
+            fetch_k = max(config.retrieval.fetch_k, k)
+
+        # embedded once, for the dense search and the diversity stage
+        query_embedding = self.embedding_model.embed_query(query)
+
+        scores = None
+        if config.retrieval.search_type == "hybrid":
+            documents, scores = self._hybrid_search(
+                collection, query, query_embedding, fetch_k, filters
+            )
+        else:
+            documents = self._dense_search(
+                collection, query_embedding, fetch_k, filters
+            )
+
+        documents = self._select_documents(
+            collection, query, query_embedding, documents, k, scores
+        )
 
-        documents = self.vector_store_retriever.invoke(query)
+        self.retrieval_cache.put(cache_key, generation, documents)
 
         return documents
 
-    def get_or_create_collection(self, collection_name: str = "default"):
-        # get the vector store instance
-        self.vector_store = vector_utils.get_vector_store(
-            data_path=config.vector_store.data_path,
-            embedding_model=self.embedding_model,
-            collection_name=collection_name,
+    def _dense_search(
+        self,
+        collection: CollectionHandle,
+        query_embedding,
+        k: int,
+        filters: dict = None,
+    ):
+        search_kwargs = {"k": k}
+        if filters:
+            search_kwargs["filter"] = filters
+
+        return collection.vector_store.similarity_search_by_vector(
+            query_embedding, **search_kwargs
         )
 
-        self.vector_store_retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 20},
+    def _hybrid_search(
+        self,
+        collection: CollectionHandle,
+        query: str,
+        query_embedding,
+        k: int,
+        filters: dict = None,
+    ):
+        """
+        Fuse the dense and BM25 rankings with reciprocal rank fusion.
+
+        :param collection:
+        :param query:
+        :param query_embedding:
+        :param k:
+        :param filters:
+        :return: the documents, best first, and their fused scores.
+        """
+        collection.ensure_lexical_index()
+        dense_documents = self._dense_search(collection, query_embedding, k, filters)
+        lexical_ids = [
+            chunk_id for chunk_id, _ in collection.lexical_index.search(query, k)
+        ]
+
+        # chroma does not return the ids, they are part of the chunk metadata
+        documents = {doc.id or doc.metadata.get("id"): doc for doc in dense_documents}
+
+        scores = defaultdict(float)
+        for rank, chunk_id in enumerate(documents):
+            scores[chunk_id] += 1 / (config.retrieval.rrf_k + rank + 1)
+        for rank, chunk_id in enumerate(lexical_ids):
+            scores[chunk_id] += 1 / (config.retrieval.rrf_k + rank + 1)
+
+        # fetch the lexical-only hits, applying the metadata filter to them too
+        missing_ids = [
+            chunk_id for chunk_id in lexical_ids if chunk_id not in documents
+        ]
+        if missing_ids:
+            get_kwargs = {"ids": missing_ids, "include": ["documents", "metadatas"]}
+            if filters:
+                get_kwargs["where"] = filters
+            result = collection.vector_store.get(**get_kwargs)
+            for chunk_id, content, metadata in zip(
+                result["ids"], result["documents"], result["metadatas"]
+            ):
+                documents[chunk_id] = Document(
+                    id=chunk_id, page_content=content, metadata=metadata
+                )
+
+        ranked_ids = sorted(
+            (chunk_id for chunk_id in scores if chunk_id in documents),
+            key=lambda chunk_id: scores[chunk_id],
+            reverse=True,
         )
 
-        return self.vector_store._collection_name
+        ranked_ids = ranked_ids[:k]
+
+        return [documents[chunk_id] for chunk_id in ranked_ids], [
+            scores[chunk_id] for chunk_id in ranked_ids
+        ]
+
+    def _select_documents(
+        self,
+        collection: CollectionHandle,
+        query: str,
+        query_embedding,
+        documents: list[Document],
+        k: int,
+        scores: list[float] = None,
+    ):
+        """
+        Pick a diverse top-k of the candidates with maximal marginal relevance over
+        their stored embeddings, optionally scored by a local cross-encoder first.
+
+        Without a cross-encoder, the relevance is the candidate scores when given
+        (the fused hybrid ranking), else the query cosine similarity.
+
+        :param collection:
+        :param query:
+        :param query_embedding:
+        :param documents: candidates, best first.
+        :param k:
+        :param scores: relevance scores of the candidates, if any.
+        :return:
+        """
+        if not documents:
+            return documents
+
+        if len(documents) <= k and not config.retrieval.rerank_model:
+            return documents
 
-    def get_collection_list(self):
-        return self.vector_store._client.list_collections()
+        relevance = None
+        if scores:
+            relevance = self._scale_scores(np.asarray(scores, dtype=np.float32))
 
-    def initialize_vector_store(self):
-        self.vector_store.reset_collection()
-        self.vector_store = vector_utils.get_vector_store(
-            data_path=config.vector_store.data_path,
-            embedding_model=self.embedding_model,
+        if config.retrieval.rerank_model:
+            relevance = self._scale_scores(
+                self._get_reranker().predict(
+                    [(query, doc.page_content) for doc in documents]
+                )
+            )
+
+            if not config.retrieval.mmr_enabled:
+                order = np.argsort(-relevance)[:k]
+                return [documents[index] for index in order]
+
+        ids = [doc.id or doc.metadata.get("id") for doc in documents]
+        if None in ids:
+            return documents[:k]
+
+        result = collection.vector_store.get(ids=ids, include=["embeddings"])
+        stored_embeddings = dict(zip(result["ids"], result["embeddings"]))
+        if len(stored_embeddings) < len(ids):
+            return documents[:k]
+
+        selected = vector_utils.maximal_marginal_relevance(
+            query_embedding=query_embedding,
+            embeddings=[stored_embeddings[doc_id] for doc_id in ids],
+            k=k,
+            lambda_mult=config.retrieval.mmr_lambda,
+            relevance=relevance,
         )
+
+        return [documents[index] for index in selected]
+
+    @staticmethod
+    def _scale_scores(scores):
+        # min-max scaled so relevance and redundancy are comparable in MMR
+        spread = float(scores.max() - scores.min()) or 1.0
+        return (scores - scores.min()) / spread
+
+    def _get_reranker(self):
+        # optional dependency, loaded on first use
+        if self.reranker is None:
+            from sentence_transformers import CrossEncoder
+
+            self.reranker = CrossEncoder(config.retrieval.rerank_model, device="cpu")
+
+        return self.reranker
+
+    async def aretrieve(
+        self,
+        query: str,
+        k: int = None,
+        filters: dict = None,
+        collection_name: str = None,
+    ):
+        """
+        Search the vector store without blocking the event loop.
+
+        :param query:
+        :param k:
+        :param filters:
+        :param collection_name:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        collection_name = collection_name or self.default_collection
+        flight_key = (
+            "retrieve",
+            self.retrieval_cache.key(
+                collection_name, query, k or config.retrieval.k, filters
+            ),
+            self.generations[collection_name],
+        )
+
+        documents = await self.retrieval_flights.do(
+            flight_key,
+            lambda: loop.run_in_executor(
+                self.executor, self.retrieve, query, k, filters, collection_name
+            ),
+        )
+        return list(documents)
+
+    async def afederated_retrieve(
+        self,
+        query: str,
+        collection_names: list[str],
+        k: int = None,
+        filters: dict = None,
+    ):
+        """
+        Search several collections concurrently and merge their results.
+
+        The query is embedded once. Every collection is searched by vector within
+        the per-collection timeout; a collection that is too slow or fails is left
+        out. Distances are turned into relevance scores of the collection's metric
+        so a top-k heap can merge the results.
+
+        :param query:
+        :param collection_names:
+        :param k: number of documents, defaults to the configured k.
+        :param filters: metadata filter passed to every collection.
+        :return: documents, with their collection and score in the metadata.
+        """
+        k = k or config.retrieval.k
+        collection_names = sorted(set(collection_names))
+
+        # raises a ValueError for an unknown collection rather than creating it
+        for name in collection_names:
+            self.get_collection(name)
+
+        cache_key = self.retrieval_cache.key(
+            ",".join(collection_names), query, k, filters
+        )
+
+        generation = tuple(self.generations[name] for name in collection_names)
+        documents = self.retrieval_cache.get(cache_key, generation)
+        if documents is not None:
+            return documents
+
+        documents = await self.retrieval_flights.do(
+            ("federated", cache_key, generation),
+            lambda: self._federated_search(
+                query, collection_names, k, filters, cache_key, generation
+            ),
+        )
+        return list(documents)
+
+    async def _federated_search(
+        self,
+        query: str,
+        collection_names: list[str],
+        k: int,
+        filters: dict,
+        cache_key: tuple,
+        generation: tuple,
+    ):
+        loop = asyncio.get_running_loop()
+        query_embedding = await loop.run_in_executor(
+            self.executor, self.embedding_model.embed_query, query
+        )
+
+        # a collection still busy with a timed out search is left out, so a slow
+        # collection holds at most one executor thread
+        searches = {}
+        for name in collection_names:
+            stalled = self.stalled_searches.get(name)
+            if stalled is not None and not stalled.done():
+                continue
+            searches[name] = self.executor.submit(
+                self._search_by_vector, name, query_embedding, k, filters
+            )
+
+        waiters = {
+            name: asyncio.wrap_future(search) for name, search in searches.items()
+        }
+        try:
+            if waiters:
+                await asyncio.wait(
+                    waiters.values(),
+                    timeout=config.retrieval.collection_timeout_seconds,
+                )
+        finally:
+            for name, waiter in waiters.items():
+                if waiter.done():
+                    continue
+                # a search not started yet is dropped, a running one cannot be
+                if not searches[name].cancel():
+                    self.stalled_searches[name] = searches[name]
+                waiter.cancel()
+
+        scored_documents = []
+        complete = True
+        for name in collection_names:
+            waiter = waiters.get(name)
+            if waiter is None:
+                error = "still running a timed out search"
+            elif waiter.cancelled():
+                error = "timed out"
+            else:
+                error = waiter.exception() and repr(waiter.exception())
+
+            if error:
+                print(f"Collection {name} left out of the search: {error}")
+                complete = False
+                continue
+            scored_documents += waiter.result()
+
+        best = heapq.nlargest(k, scored_documents, key=lambda item: item[1])
+        documents = []
+        for doc, score in best:
+            doc.metadata["score"] = round(score, 4)
+            documents.append(doc)
+
+        # a partial result must not hide the slow collection on the next search
+        if complete:
+            self.retrieval_cache.put(cache_key, generation, documents)
+
+        return documents
+
+    def _search_by_vector(
+        self, collection_name: str, query_embedding, k: int, filters: dict = None
+    ) -> list[tuple[Document, float]]:
+        collection = self.get_collection(collection_name)
+        relevance_score_fn = collection.vector_store._select_relevance_score_fn()
+
+        search_kwargs = {"k": k}
+        if filters:
+            search_kwargs["filter"] = filters
+
+        results = (
+            collection.vector_store.similarity_search_by_vector_with_relevance_scores(
+                query_embedding, **search_kwargs
+            )
+        )
+
+        scored_documents = []
+        for doc, distance in results:
+            doc.metadata["collection"] = collection.name
+            scored_documents.append((doc, relevance_score_fn(distance)))
+
+        return scored_documents
+
+    async def aembed_queries(self, queries: list[str]):
+        """
+        Embed many queries in one batched call ahead of their searches, which then
+        read the vectors from the embedding cache. Without the cache the vectors
+        could not be reused, so nothing is done here: every search embeds its own
+        query and only the query micro-batcher groups the concurrent ones.
+
+        :param queries:
+        :return:
+        """
+        if not hasattr(self.embedding_model, "embed_queries"):
+            return
+
+        loop = asyncio.get_running_loop()
+        for start in range(0, len(queries), self.batch_limits["max_chunks"]):
+            await loop.run_in_executor(
+                self.executor,
+                self.embedding_model.embed_queries,
+                queries[start : start + self.batch_limits["max_chunks"]],
+            )
+
+    def is_collection_empty(self, collection_name: str = None) -> bool:
+        """
+        Check if a collection has no chunks, counted once per generation.
+
+        :param collection_name:
+        :return:
+        """
+        collection = self.get_collection(collection_name)
+        generation = self.generations[collection.name]
+
+        cached = self.collection_sizes.get(collection.name)
+        if cached is None or cached[0] != generation:
+            cached = (generation, collection.vector_store._collection.count())
+            self.collection_sizes[collection.name] = cached
+
+        return cached[1] == 0
+
+    def cache_stats(self) -> dict:
+        """
+        Statistics of the retrieval and embedding caches.
+
+        :return:
+        """
+        stats = {
+            "retrieval": self.retrieval_cache.stats(),
+            "coalesced_searches": self.retrieval_flights.stats(),
+        }
+        if hasattr(self.embedding_model, "stats"):
+            stats["embeddings"] = self.embedding_model.stats()
+
+        # the query micro-batcher sits below the cache
+        model = self.embedding_model
+        while model is not None:
+            if isinstance(model, MicroBatchedEmbeddings):
+                stats["query_batches"] = model.stats()
+            model = getattr(model, "embedding_model", None)
+
+        return stats
+
+    def get_or_create_collection(self, collection_name: str = "default"):
+        """
+        Open a collection and make it the default of the requests that do not
+        name one.
+
+        :param collection_name:
+        :return:
+        """
+        collection = self.registry.get(collection_name)
+        self.default_collection = collection.name
+
+        return collection.name
+
+    def get_collection_list(self):
+        return self.registry.list_collections()
+
+    def initialize_vector_store(self, collection_name: str = None):
+        collection = self.get_collection(collection_name)
+        collection.vector_store.reset_collection()
+        collection.manifest.clear()
+        collection.lexical_index.clear()
+        self._bump_generation(collection.name)
@@ -0,0 +1,184 @@
+"""
+Offline benchmark of ingestion, retrieval and end-to-end question answering.
+
+Runs without a LLM backend or a model download: the embedding model is a
+deterministic hash embedding and the LLM a fake chat model with configurable
+latency and token rate. Everything else (caches, admission control,
+scheduler, graph, routers) is the production code.
+
+    cd src && python -m benchmark --output benchmark.json --baseline previous.json
+
+Settings come from the environment as usual; the defaults below only fill in
+what is not set, with the data in a temporary directory.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmark")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results file")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    parser.add_argument("--data-path", help="data directory, temporary by default")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--pdf-pages", type=int, default=20, help="0 skips the PDF")
+    parser.add_argument("--corpus-sizes", default="100,1000,10000")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--users", default="1,8,32")
+    parser.add_argument("--requests-per-user", type=int, default=5)
+    parser.add_argument("--embedding-size", type=int, default=384)
+    parser.add_argument(
+        "--embedding-seconds", type=float, default=0.0, help="cost of a model call"
+    )
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--llm-answer-tokens", type=int, default=64)
+
+    return parser.parse_args()
+
+
+def _set_environment_defaults(data_path: str):
+    # must run before config is imported
+    defaults = {
+        "VECTOR_STORE__DATA_PATH": data_path,
+        "VECTOR_STORE__RESOURCE_PATH": os.path.join(data_path, "resources"),
+        "LLMS__LLM_TYPE": "openai",
+        "LLMS__TEMPERATURE": "0",
+        "LLMS__LLM_NAME": "benchmark",
+        "LLMS__API_KEY": "benchmark",
+        "LLMS__LOCAL_SERVER": "http://localhost:11434",
+        "EMBEDDINGS__EMBEDDING_TYPE": "huggingface",
+        "EMBEDDINGS__EMBEDDING_MODEL": "benchmark-hash",
+        "ANONYMIZED_TELEMETRY": "False",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+def _install_fakes(args):
+    # the model factories are replaced, the wrappers around them are kept
+    from benchmark.fakes import FakeChatModel, HashEmbeddings
+    from common import llm_utils
+
+    def get_embedding(**kwargs):
+        return HashEmbeddings(args.embedding_size, args.embedding_seconds)
+
+    def get_llm(**kwargs):
+        return FakeChatModel(
+            latency_seconds=args.llm_latency,
+            tokens_per_second=args.llm_tokens_per_second,
+            answer_tokens=args.llm_answer_tokens,
+        )
+
+    llm_utils.get_openai_embedding = get_embedding
+    llm_utils.get_huggingface_embedding = get_embedding
+    llm_utils.get_llm = get_llm
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _flatten(value, prefix: str = "") -> dict:
+    # numeric leaves by path, list items by their corpus size or user count
+    if isinstance(value, dict):
+        leaves = {}
+        for key, item in value.items():
+            leaves.update(_flatten(item, f"{prefix}.{key}" if prefix else key))
+        return leaves
+    if isinstance(value, list):
+        leaves = {}
+        for index, item in enumerate(value):
+            label = index
+            if isinstance(item, dict):
+                label = item.get("corpus_size", item.get("users", index))
+            leaves.update(_flatten(item, f"{prefix}[{label}]"))
+        return leaves
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+
+    return {}
+
+
+def _compare(baseline: dict, results: dict):
+    """
+    Print the metrics that changed by more than 10% since the baseline.
+    """
+    old = _flatten(baseline.get("results", {}))
+    new = _flatten(results["results"])
+
+    print(f"Compared with {baseline.get('git_commit') or 'baseline'}:")
+    for path, value in new.items():
+        previous = old.get(path)
+        if not previous or path.endswith(("count", "requests", "users", "pages")):
+            continue
+
+        change = (value - previous) / abs(previous)
+        if abs(change) > 0.1:
+            print(f"  {path}: {previous} -> {value} ({change:+.0%})")
+
+
+def main():
+    args = _parse_args()
+
+    if args.data_path:
+        _run(args, args.data_path)
+        return
+
+    with tempfile.TemporaryDirectory(
+        prefix="rag-bot-benchmark-", ignore_cleanup_errors=True
+    ) as data_path:
+        _run(args, data_path)
+
+
+def _run(args, data_path: str):
+    _set_environment_defaults(data_path)
+    _install_fakes(args)
+
+    from benchmark import suite
+
+    results = asyncio.run(
+        suite.run(
+            chunk_count=args.chunks,
+            pdf_pages=args.pdf_pages,
+            corpus_sizes=[int(size) for size in args.corpus_sizes.split(",")],
+            query_count=args.queries,
+            user_counts=[int(users) for users in args.users.split(",")],
+            requests_per_user=args.requests_per_user,
+            work_dir=data_path,
+        )
+    )
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Benchmark results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            _compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import random
+from typing import List
+
+from langchain_core.documents import Document
+
+_TOPICS = [
+    "refund",
+    "shipping",
+    "warranty",
+    "invoice",
+    "subscription",
+    "password",
+    "delivery",
+    "discount",
+    "account",
+    "privacy",
+    "support",
+    "installation",
+]
+_WORDS = (
+    "the customer policy request order payment service product team period days "
+    "month week within after before during contact email phone form portal fee "
+    "limit standard express region country business personal approval review "
+    "update change cancel renew transfer verify confirm receive return replace"
+).split()
+
+
+def make_chunks(
+    count: int, seed: int = 0, words_per_chunk: int = 120
+) -> List[Document]:
+    """
+    Deterministic synthetic chunks, each about one topic.
+
+    :param count: number of chunks.
+    :param seed:
+    :param words_per_chunk:
+    :return:
+    """
+    rng = random.Random(seed)
+    chunks = []
+
+    for index in range(count):
+        topic = _TOPICS[index % len(_TOPICS)]
+        words = [rng.choice(_WORDS) for _ in range(words_per_chunk)]
+        # mention the topic and the section a few times, as real sections do
+        for position in rng.sample(range(words_per_chunk), 6):
+            words[position] = topic if position % 2 else f"section{index}"
+
+        chunks.append(
+            Document(
+                page_content=f"Section {index} about {topic}. " + " ".join(words),
+                metadata={"source": "synthetic", "page": index // 4 + 1},
+            )
+        )
+
+    return chunks
+
+
+def make_queries(count: int, seed: int = 1) -> List[str]:
+    """
+    Deterministic distinct questions about the synthetic topics.
+
+    :param count:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+
+    return [
+        f"What does the {rng.choice(_TOPICS)} policy say about the "
+        f"{rng.choice(_WORDS)} {rng.choice(_WORDS)}? (question {index})"
+        for index in range(count)
+    ]
+
+
+def write_pdf(path: str, pages: int, seed: int = 0):
+    """
+    Write a PDF with text paragraphs and a ruled table on every page, without a
+    PDF library.
+
+    :param path:
+    :param pages:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, once the pages are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+
+    for page in range(pages):
+        commands = ["BT /F1 10 Tf 50 760 Td 14 TL"]
+        for line in range(24):
+            words = " ".join(rng.choice(_WORDS) for _ in range(12))
+            topic = _TOPICS[(page + line) % len(_TOPICS)]
+            commands.append(f"(Page {page + 1} {topic}: {words}.) '")
+        commands.append("ET")
+
+        # a 4 x 3 table with ruling lines, found by the table extraction
+        top, left, row_height, column_width = 360, 50, 24, 160
+        for row in range(4):
+            for column in range(3):
+                x = left + column * column_width
+                y = top - (row + 1) * row_height
+                commands.append(f"{x} {y} {column_width} {row_height} re S")
+                cell = "Plan" if row == 0 else f"{rng.choice(_TOPICS)} {row}{column}"
+                commands.append(f"BT /F1 9 Tf {x + 6} {y + 8} Td ({cell}) Tj ET")
+
+        content = "\n".join(commands).encode("latin-1")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (len(objects))
+        )
+        page_ids.append(len(objects))
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode("latin-1")
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+
+    with open(path, "wb") as file:
+        file.write(output)
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import math
+import re
+import time
+import uuid
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_word_pattern = re.compile(r"\w+")
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic embeddings without a model: every word is hashed into one of
+    `size` signed buckets and the vector is L2-normalized, so texts sharing
+    words are close and the same text always gets the same vector.
+    """
+
+    def __init__(self, size: int = 384, seconds_per_call: float = 0.0):
+        """
+        :param size: vector dimension.
+        :param seconds_per_call: simulated cost of one model call.
+        """
+        self.size = size
+        self.seconds_per_call = seconds_per_call
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.seconds_per_call:
+            time.sleep(self.seconds_per_call)
+
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for word in _word_pattern.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.size
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering after a configurable latency at a configurable token
+    rate, without a backend.
+
+    Asked with tools (no system prompt), it calls the retrieval tool with the
+    question; asked with the RAG prompt, it answers `answer_tokens` tokens.
+    """
+
+    latency_seconds: float = 0.2
+    tokens_per_second: float = 50.0
+    answer_tokens: int = 64
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages) -> AIMessage:
+        if messages[0].type != "system" and messages[-1].type == "human":
+            return AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": "retrieve_documents",
+                        "args": {"query": messages[-1].content},
+                        "id": f"call_{uuid.uuid4().hex[:12]}",
+                    }
+                ],
+            )
+
+        return AIMessage(content=" ".join(self._tokens()))
+
+    def _tokens(self) -> List[str]:
+        return [f"token{index}" for index in range(self.answer_tokens)]
+
+    def _seconds(self, message: AIMessage) -> float:
+        tokens = 0 if message.tool_calls else self.answer_tokens
+        return self.latency_seconds + tokens / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        message = self._respond(messages)
+        time.sleep(self._seconds(message))
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        message = self._respond(messages)
+        await asyncio.sleep(self._seconds(message))
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        message = self._respond(messages)
+        await asyncio.sleep(self.latency_seconds)
+
+        if message.tool_calls:
+            tool_call = message.tool_calls[0]
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": tool_call["name"],
+                            "args": json.dumps(tool_call["args"]),
+                            "id": tool_call["id"],
+                            "index": 0,
+                        }
+                    ],
+                )
+            )
+            return
+
+        for index, token in enumerate(self._tokens()):
+            if index:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content=" " + token if index else token)
+            )
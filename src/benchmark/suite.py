@@ -0,0 +1,233 @@
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from adapter import document_retriever, llm_service
+from benchmark.corpus import make_chunks, make_queries, write_pdf
+from common import loaders
+from config import config
+from entrypoints import middleware
+from entrypoints.router.v1 import router
+
+
+def create_app() -> FastAPI:
+    # the app of entrypoints.main, without the lambda handler
+    app = FastAPI(title="RAG-Bot benchmark")
+    app.include_router(router.router)
+    middleware.configure(app)
+
+    return app
+
+
+def summarize(latencies: list[float]) -> dict:
+    """
+    Latency percentiles in seconds.
+
+    :param latencies:
+    :return:
+    """
+    if not latencies:
+        return {"count": 0}
+
+    ordered = sorted(latencies)
+
+    def percentile(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 5)
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 5),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": round(ordered[-1], 5),
+    }
+
+
+async def ingest(documents, collection: str, source: str) -> dict:
+    """
+    Run one ingestion job to completion.
+
+    :param documents: chunks or a loader stream.
+    :param collection:
+    :param source:
+    :return: job counters and wall time.
+    """
+    started = time.perf_counter()
+    job = await document_retriever.add_documents(
+        documents, collection_name=collection, source=source
+    )
+    while job.state not in ("done", "failed"):
+        await asyncio.sleep(0.01)
+
+    return {
+        "state": job.state,
+        "error": job.error,
+        "chunks_added": job.chunks_added,
+        "seconds": round(time.perf_counter() - started, 4),
+        "chunks_per_second": job.chunks_per_second,
+        "searchable_after_seconds": job.searchable_after_seconds,
+    }
+
+
+async def bench_ingestion(chunk_count: int, pdf_pages: int, work_dir: str) -> dict:
+    """
+    Ingestion throughput of synthetic chunks and of a generated PDF parsed by
+    load_pdf_with_tables.
+
+    :param chunk_count:
+    :param pdf_pages: pages of the PDF, 0 skips it.
+    :param work_dir: directory of the generated PDF.
+    :return:
+    """
+    results = {
+        "chunks": await ingest(
+            make_chunks(chunk_count, seed=7), "bench-ingest", f"synthetic-{chunk_count}"
+        )
+    }
+
+    if pdf_pages:
+        pdf_path = os.path.join(work_dir, f"benchmark-{pdf_pages}.pdf")
+        write_pdf(pdf_path, pdf_pages)
+        results["pdf"] = {
+            "pages": pdf_pages,
+            **await ingest(
+                loaders.load_pdf_with_tables(pdf_path), "bench-pdf", pdf_path
+            ),
+        }
+
+    return results
+
+
+async def bench_retrieval(corpus_sizes: list[int], query_count: int) -> list[dict]:
+    """
+    Retrieval latency per corpus size, with distinct queries so the retrieval
+    cache does not answer.
+
+    :param corpus_sizes:
+    :param query_count:
+    :return:
+    """
+    results = []
+
+    for size in corpus_sizes:
+        collection = f"bench-corpus-{size}"
+        ingestion = await ingest(make_chunks(size, seed=size), collection, collection)
+
+        latencies = []
+        for query in make_queries(query_count, seed=size):
+            started = time.perf_counter()
+            await document_retriever.aretrieve(query, collection_name=collection)
+            latencies.append(time.perf_counter() - started)
+
+        results.append(
+            {
+                "corpus_size": size,
+                "ingestion_seconds": ingestion["seconds"],
+                "latency": summarize(latencies),
+            }
+        )
+        print(f"Retrieval over {size} chunks: {results[-1]['latency']}")
+
+    return results
+
+
+async def bench_generate(
+    app: FastAPI, user_counts: list[int], requests_per_user: int, collection: str
+) -> list[dict]:
+    """
+    End-to-end /v1/generate latency and throughput with concurrent users, every
+    user sending its questions one after the other.
+
+    :param app:
+    :param user_counts:
+    :param requests_per_user:
+    :param collection: collection the questions are answered from.
+    :return:
+    """
+    results = []
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark", timeout=600
+    ) as client:
+        for users in user_counts:
+            latencies = []
+            statuses = {}
+            queries = make_queries(users * requests_per_user, seed=1000 + users)
+            llm_calls = llm_service.llm.calls
+
+            async def user(index: int):
+                for number in range(requests_per_user):
+                    query = queries[index * requests_per_user + number]
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/v1/generate",
+                        json={"query": query, "collection": collection},
+                        headers={"x-user-id": f"benchmark-{users}-{index}"},
+                    )
+                    latencies.append(time.perf_counter() - started)
+                    statuses[response.status_code] = (
+                        statuses.get(response.status_code, 0) + 1
+                    )
+
+            started = time.perf_counter()
+            await asyncio.gather(*(user(index) for index in range(users)))
+            seconds = time.perf_counter() - started
+
+            results.append(
+                {
+                    "users": users,
+                    "requests": users * requests_per_user,
+                    "seconds": round(seconds, 4),
+                    "requests_per_second": round(statuses.get(200, 0) / seconds, 3),
+                    "status_codes": {str(code): n for code, n in statuses.items()},
+                    "llm_calls": llm_service.llm.calls - llm_calls,
+                    "latency": summarize(latencies),
+                }
+            )
+            print(f"/v1/generate with {users} users: {results[-1]['latency']}")
+
+    return results
+
+
+async def run(
+    chunk_count: int,
+    pdf_pages: int,
+    corpus_sizes: list[int],
+    query_count: int,
+    user_counts: list[int],
+    requests_per_user: int,
+    work_dir: str,
+) -> dict:
+    """
+    Run every benchmark.
+
+    :return: the results, by benchmark.
+    """
+    results = {
+        "settings": {
+            "llm_type": config.llms.llm_type,
+            "embedding_type": config.embeddings.embedding_type,
+            "search_type": config.retrieval.search_type,
+            "routing_mode": config.routing.mode,
+            "embedding_cache": config.embeddings.cache_enabled,
+            "llm_concurrency": llm_service.admission.max_concurrent,
+        },
+        "ingestion": await bench_ingestion(chunk_count, pdf_pages, work_dir),
+        "retrieval": await bench_retrieval(corpus_sizes, query_count),
+    }
+
+    # the end-to-end questions are answered from the largest corpus
+    results["generate"] = await bench_generate(
+        create_app(),
+        user_counts,
+        requests_per_user,
+        f"bench-corpus-{max(corpus_sizes)}",
+    )
+
+    return results
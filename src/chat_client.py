@@ -29,34 +29,30 @@ async def chat_with_qwen(user_input: str, user_name: str, client):
     # Send the input to the generate_stream endpoint
     try:
         print("=============================================================")
-        response = await client.post(
+        async with client.stream(
+            "POST",
             "http://localhost:8000/v1/generate-stream",
             headers={"x-user-id": user_name},
             json={"query": user_input},
             timeout=None,  # Allow indefinite streaming
-        )
-
-        # Check if the response is streaming
-        if response.status_code == 200:
-            print(
-                f"{Back.LIGHTCYAN_EX}{Fore.BLACK}Qwen:{Style.RESET_ALL} ",
-                end="",
-                flush=True,
-            )
-            async for chunk in response.aiter_text():
-                chunk = chunk.replace(
-                    "\\n", "\n"
-                )  # Convert escaped newlines to actual newlines
-                for char in chunk:
+        ) as response:
+            # Check if the response is streaming
+            if response.status_code == 200:
+                print(
+                    f"{Back.LIGHTCYAN_EX}{Fore.BLACK}Qwen:{Style.RESET_ALL} ",
+                    end="",
+                    flush=True,
+                )
+                # print the tokens as they arrive
+                async for chunk in response.aiter_text():
                     print(
-                        Fore.LIGHTMAGENTA_EX + char + Style.RESET_ALL,
+                        Fore.LIGHTMAGENTA_EX + chunk + Style.RESET_ALL,
                         end="",
                         flush=True,
                     )
-                    await asyncio.sleep(0.01)  # Typing delay
-            print()  # Newline after the complete response
-        else:
-            print(f"Error: Received status code {response.status_code}")
+                print()  # Newline after the complete response
+            else:
+                print(f"Error: Received status code {response.status_code}")
         print("=============================================================")
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,239 @@
+import asyncio
+import contextlib
+import math
+import threading
+import time
+from collections import deque
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class AdmissionRejected(Exception):
+    """
+    A backend is saturated: the call was refused instead of queued.
+    """
+
+    def __init__(self, backend: str, retry_after: int):
+        super().__init__(f"{backend} is saturated, retry after {retry_after}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.granted = False
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+
+    def wake(self):
+        self.granted = True
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdmissionController:
+    """
+    Bounds the calls running at once against one backend.
+
+    Calls beyond the limit wait in a bounded FIFO queue. A call is rejected right
+    away when the queue is full or its expected wait exceeds the deadline, and
+    after the deadline if it is still waiting, so a burst fails fast instead of
+    piling up timeouts for everyone. Slots can be taken from the event loop and
+    from worker threads.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        max_concurrent: int,
+        max_waiting: int,
+        max_wait_seconds: float,
+    ):
+        """
+        :param backend: name of the backend, reported in rejections.
+        :param max_concurrent: calls running at once.
+        :param max_waiting: calls waiting for a slot.
+        :param max_wait_seconds: longest wait for a slot.
+        """
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        # moving average of the time a call holds its slot
+        self.service_seconds = 1.0
+
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _expected_wait(self, waiting: int) -> float:
+        return waiting * self.service_seconds / self.max_concurrent
+
+    def _reject(self) -> AdmissionRejected:
+        self.rejected += 1
+        retry_after = self._expected_wait(len(self._waiters) + 1)
+        return AdmissionRejected(self.backend, max(1, math.ceil(retry_after)))
+
+    def _try_acquire(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        Take a free slot or queue a waiter, under the lock.
+
+        :return: None if a slot was taken, the waiter otherwise.
+        """
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return None
+
+        if len(self._waiters) >= self.max_waiting or (
+            self._expected_wait(len(self._waiters) + 1) > self.max_wait_seconds
+        ):
+            raise self._reject()
+
+        waiter = _Waiter(loop)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """
+        Leave the queue after the deadline, unless a slot was handed over meanwhile.
+
+        :return: whether the waiter holds a slot.
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+
+            self._waiters.remove(waiter)
+            return False
+
+    def check(self):
+        """
+        Reject now if a call would be rejected, without taking a slot. Used before
+        a response starts streaming, when a rejection can still be reported.
+
+        :return:
+        """
+        with self._lock:
+            if self.active < self.max_concurrent and not self._waiters:
+                return
+            if len(self._waiters) >= self.max_waiting or (
+                self._expected_wait(len(self._waiters) + 1) > self.max_wait_seconds
+            ):
+                raise self._reject()
+
+    def release(self, held_seconds: float):
+        """
+        Free a slot, handing it over to the oldest waiter if any.
+
+        :param held_seconds: how long the slot was held.
+        :return:
+        """
+        with self._lock:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * held_seconds
+
+            if self._waiters:
+                self.admitted += 1
+                self._waiters.popleft().wake()
+            else:
+                self.active -= 1
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        """
+        Hold a slot for the duration of an async call.
+
+        :return:
+        """
+        with self._lock:
+            waiter = self._try_acquire(asyncio.get_running_loop())
+
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(waiter.future), self.max_wait_seconds
+                )
+            except asyncio.TimeoutError:
+                if not self._give_up(waiter):
+                    with self._lock:
+                        raise self._reject()
+            except asyncio.CancelledError:
+                if self._give_up(waiter):
+                    self.release(0.0)
+                raise
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Hold a slot for the duration of a blocking call, from a worker thread.
+
+        :return:
+        """
+        with self._lock:
+            waiter = self._try_acquire()
+
+        if waiter is not None and not waiter.event.wait(self.max_wait_seconds):
+            if not self._give_up(waiter):
+                with self._lock:
+                    raise self._reject()
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        """
+        Slots in use, queue length and admission counters.
+
+        :return:
+        """
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self.active,
+                "waiting": len(self._waiters),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "service_seconds": round(self.service_seconds, 3),
+            }
+
+
+class AdmittedEmbeddings(Embeddings):
+    """
+    Embedding model whose calls go through an admission controller.
+    """
+
+    def __init__(self, embedding_model: Embeddings, admission: AdmissionController):
+        """
+        :param embedding_model: the embedding model to call.
+        :param admission: controller of the embedding backend.
+        """
+        self.embedding_model = embedding_model
+        self.admission = admission
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.admission.slot():
+            return self.embedding_model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.admission.slot():
+            return self.embedding_model.embed_query(text)
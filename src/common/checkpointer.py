@@ -0,0 +1,481 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+from langchain_core.messages import trim_messages
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.constants import TASKS
+
+
+def get_checkpointer(
+    checkpointer_type: str = "sqlite",
+    path: str = None,
+    hot_threads: int = 1000,
+    idle_ttl_seconds: float = 604800,
+    max_messages: int = 40,
+):
+    """
+    decide which conversation checkpointer to use
+
+    :param checkpointer_type: sqlite or memory.
+    :param path: path of the SQLite file.
+    :param hot_threads: number of threads kept in memory.
+    :param idle_ttl_seconds: threads idle for longer are deleted.
+    :param max_messages: maximum number of messages stored per thread.
+    :return:
+    """
+    if checkpointer_type == "sqlite":
+        return SqliteCheckpointSaver(
+            path=path,
+            hot_threads=hot_threads,
+            idle_ttl_seconds=idle_ttl_seconds,
+            max_messages=max_messages,
+        )
+    elif checkpointer_type == "memory":
+        return MemorySaver()
+    else:
+        raise ValueError(f"Unsupported checkpointer: {checkpointer_type}")
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver):
+    """
+    Conversation checkpointer that keeps only the latest checkpoint of every
+    thread in SQLite.
+
+    Recently used threads are also kept serialized in an LRU hot tier, threads idle
+    for longer than the TTL are deleted, and the stored message history is trimmed
+    to the last messages starting at a human message. Memory stays flat however
+    many users are seen, and conversations survive restarts.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        hot_threads: int = 1000,
+        idle_ttl_seconds: float = 604800,
+        max_messages: int = 40,
+    ):
+        """
+        :param path: path of the SQLite file.
+        :param hot_threads: number of threads kept in memory.
+        :param idle_ttl_seconds: threads idle for longer are deleted.
+        :param max_messages: maximum number of messages stored per thread.
+        """
+        super().__init__()
+        self.hot_threads = hot_threads
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_messages = max_messages
+
+        self._hot = OrderedDict()  # (thread id, namespace) -> row
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB NOT NULL,
+                metadata_type TEXT,
+                metadata BLOB NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns)
+            );
+            CREATE INDEX IF NOT EXISTS checkpoints_updated_at
+                ON checkpoints (updated_at);
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            """)
+        self._connection.commit()
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+
+        with self._lock:
+            row = self._get_row(str(thread_id), checkpoint_ns)
+            if row is None:
+                return None
+            # put_writes updates the writes of the row in place
+            row = {
+                **row,
+                "writes": dict(row["writes"]),
+                "parent_writes": dict(row["parent_writes"]),
+            }
+
+        # only the latest checkpoint is kept
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id and checkpoint_id != row["checkpoint_id"]:
+            return None
+
+        return self._to_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns FROM checkpoints"
+        parameters = []
+        if config:
+            query += " WHERE thread_id = ?"
+            parameters.append(str(config["configurable"]["thread_id"]))
+        query += " ORDER BY updated_at DESC"
+
+        with self._lock:
+            keys = self._connection.execute(query, parameters).fetchall()
+
+        before_id = get_checkpoint_id(before) if before else None
+        for thread_id, checkpoint_ns in keys:
+            if limit is not None and limit <= 0:
+                break
+
+            checkpoint_tuple = self.get_tuple(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                    }
+                }
+            )
+            if checkpoint_tuple is None:
+                continue
+            checkpoint_id = checkpoint_tuple.config["configurable"]["checkpoint_id"]
+            if before_id and checkpoint_id >= before_id:
+                continue
+            if filter and not all(
+                checkpoint_tuple.metadata.get(key) == value
+                for key, value in filter.items()
+            ):
+                continue
+
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        parent_checkpoint_id = config["configurable"].get("checkpoint_id")
+
+        checkpoint = checkpoint.copy()
+        checkpoint.pop("pending_sends", None)
+        checkpoint["channel_values"] = self._trim(checkpoint["channel_values"])
+
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(metadata)
+        now = time.time()
+
+        with self._lock:
+            previous = self._get_row(thread_id, checkpoint_ns)
+
+            self._connection.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, "
+                "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, "
+                "metadata, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    parent_checkpoint_id,
+                    checkpoint_type,
+                    checkpoint_blob,
+                    metadata_type,
+                    metadata_blob,
+                    now,
+                ),
+            )
+            # the writes of the parent are kept for its pending sends
+            self._connection.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+                "AND checkpoint_id NOT IN (?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    parent_checkpoint_id or "",
+                ),
+            )
+            self._connection.commit()
+
+            parent_writes = {}
+            if previous and previous["checkpoint_id"] == parent_checkpoint_id:
+                parent_writes = previous["writes"]
+            elif parent_checkpoint_id:
+                parent_writes = self._read_writes(
+                    thread_id, checkpoint_ns, parent_checkpoint_id
+                )
+
+            self._remember(
+                (thread_id, checkpoint_ns),
+                {
+                    "checkpoint_id": checkpoint["id"],
+                    "parent_checkpoint_id": parent_checkpoint_id,
+                    "checkpoint": (checkpoint_type, checkpoint_blob),
+                    "metadata": (metadata_type, metadata_blob),
+                    "writes": {},
+                    "parent_writes": parent_writes,
+                },
+            )
+            self._sweep(now)
+
+        return {
+            "configurable": {
+                "thread_id": config["configurable"]["thread_id"],
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        with self._lock:
+            row = self._get_row(thread_id, checkpoint_ns)
+            stored = (
+                row["writes"] if row and row["checkpoint_id"] == checkpoint_id else {}
+            )
+
+            new_writes = {}
+            for index, (channel, value) in enumerate(writes):
+                key = (task_id, WRITES_IDX_MAP.get(channel, index))
+                # special writes are stored once, regular ones are replaced
+                if key[1] < 0 and key in stored:
+                    continue
+                new_writes[key] = (channel, *self.serde.dumps_typed(value))
+
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO writes (thread_id, checkpoint_ns, checkpoint_id, "
+                "task_id, idx, channel, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (thread_id, checkpoint_ns, checkpoint_id, key[0], key[1], *write)
+                    for key, write in new_writes.items()
+                ],
+            )
+            self._connection.commit()
+
+            if row and row["checkpoint_id"] == checkpoint_id:
+                row["writes"].update(new_writes)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+    def stats(self) -> dict:
+        """
+        Number of stored conversation threads and of the ones kept in memory.
+
+        :return:
+        """
+        with self._lock:
+            threads = self._connection.execute(
+                "SELECT COUNT(*) FROM checkpoints"
+            ).fetchone()[0]
+
+            return {"threads": threads, "hot_threads": len(self._hot)}
+
+    def _trim(self, channel_values: dict) -> dict:
+        messages = channel_values.get("messages")
+        if not messages or len(messages) <= self.max_messages:
+            return channel_values
+
+        # starting at a human message never leaves a tool result without its call
+        trimmed = trim_messages(
+            messages,
+            max_tokens=self.max_messages,
+            token_counter=len,
+            strategy="last",
+            start_on="human",
+            include_system=True,
+        )
+
+        return {**channel_values, "messages": trimmed}
+
+    def _get_row(self, thread_id: str, checkpoint_ns: str):
+        key = (thread_id, checkpoint_ns)
+        row = self._hot.get(key)
+        if row is not None:
+            self._hot.move_to_end(key)
+            return row
+
+        stored = self._connection.execute(
+            "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+            "metadata_type, metadata FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ?",
+            key,
+        ).fetchone()
+        if stored is None:
+            return None
+
+        checkpoint_id, parent_checkpoint_id = stored[0], stored[1]
+        row = {
+            "checkpoint_id": checkpoint_id,
+            "parent_checkpoint_id": parent_checkpoint_id,
+            "checkpoint": (stored[2], stored[3]),
+            "metadata": (stored[4], stored[5]),
+            "writes": self._read_writes(thread_id, checkpoint_ns, checkpoint_id),
+            "parent_writes": (
+                self._read_writes(thread_id, checkpoint_ns, parent_checkpoint_id)
+                if parent_checkpoint_id
+                else {}
+            ),
+        }
+        self._remember(key, row)
+
+        return row
+
+    def _read_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str):
+        rows = self._connection.execute(
+            "SELECT task_id, idx, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? "
+            "ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+
+        return {(row[0], row[1]): (row[2], row[3], row[4]) for row in rows}
+
+    def _remember(self, key: tuple, row: dict):
+        self._hot[key] = row
+        self._hot.move_to_end(key)
+
+        while len(self._hot) > self.hot_threads:
+            self._hot.popitem(last=False)
+
+    def _sweep(self, now: float):
+        # delete the idle threads at most once a minute
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+
+        deadline = now - self.idle_ttl_seconds
+        expired = self._connection.execute(
+            "SELECT thread_id, checkpoint_ns FROM checkpoints WHERE updated_at < ?",
+            (deadline,),
+        ).fetchall()
+        if not expired:
+            return
+
+        self._connection.executemany(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ?", expired
+        )
+        self._connection.execute(
+            "DELETE FROM checkpoints WHERE updated_at < ?", (deadline,)
+        )
+        self._connection.commit()
+
+        for key in expired:
+            self._hot.pop(tuple(key), None)
+        print(f"Deleted {len(expired)} idle conversation threads.")
+
+    def _to_tuple(self, thread_id, checkpoint_ns: str, row: dict) -> CheckpointTuple:
+        parent_checkpoint_id = row["parent_checkpoint_id"]
+        sends = [
+            self.serde.loads_typed((value_type, value))
+            for channel, value_type, value in row["parent_writes"].values()
+            if channel == TASKS
+        ]
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": row["checkpoint_id"],
+                }
+            },
+            checkpoint={
+                **self.serde.loads_typed(row["checkpoint"]),
+                "pending_sends": sends,
+            },
+            metadata=self.serde.loads_typed(row["metadata"]),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for (task_id, _), (channel, value_type, value) in row["writes"].items()
+            ],
+        )
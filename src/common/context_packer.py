@@ -0,0 +1,88 @@
+import re
+from typing import Callable
+
+from langchain_core.documents import Document
+
+from common import utils
+
+_word_pattern = re.compile(r"\w+")
+
+
+class ContextPacker:
+    """
+    Packs retrieved chunks into the prompt context within a token budget.
+
+    Chunks are taken in relevance order, near-duplicates of an already packed
+    chunk are dropped and every chunk is preceded by a compact source tag.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_tokens: int,
+        duplicate_threshold: float = 0.9,
+    ):
+        """
+        :param count_tokens: token counter of the LLM.
+        :param max_tokens: token budget of the context.
+        :param duplicate_threshold: word overlap (Jaccard) above which a chunk is a duplicate.
+        """
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+
+    def pack(self, documents: list[Document]) -> str:
+        """
+        Format the chunks that fit in the budget.
+
+        :param documents: chunks, most relevant first.
+        :return: the context.
+        """
+        packed = []
+        packed_words = []
+        used_tokens = 0
+        separator_tokens = self.count_tokens("\n\n")
+
+        for document in documents:
+            words = set(_word_pattern.findall(document.page_content.lower()))
+            if any(
+                self._overlap(words, other) >= self.duplicate_threshold
+                for other in packed_words
+            ):
+                continue
+
+            text = utils.format_document(document)
+            tokens = self.count_tokens(text) + (separator_tokens if packed else 0)
+
+            if used_tokens + tokens > self.max_tokens:
+                if packed:
+                    # a less relevant but shorter chunk may still fit
+                    continue
+
+                # the most relevant chunk alone is over budget: keep its beginning
+                text = self._truncate(text, self.max_tokens)
+                tokens = self.count_tokens(text)
+
+            packed.append(text)
+            packed_words.append(words)
+            used_tokens += tokens
+
+        print(
+            f"Packed {len(packed)}/{len(documents)} chunks into {used_tokens} context tokens."
+        )
+
+        return "\n\n".join(packed)
+
+    def _overlap(self, words: set, other: set) -> float:
+        if not words or not other:
+            return 0.0
+
+        return len(words & other) / len(words | other)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        # shrink proportionally until the text fits
+        while text and self.count_tokens(text) > max_tokens:
+            ratio = max_tokens / self.count_tokens(text)
+            text = text[: max(int(len(text) * ratio * 0.95), 0)]
+
+        return text
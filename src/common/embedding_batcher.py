@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class MicroBatchedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper batching concurrent query embeddings.
+
+    Queries embedded from any thread are queued; a batching thread takes the
+    first one, collects the others arriving within max_wait_ms up to
+    max_batch_size and embeds them in one embed_documents call, so concurrent
+    searches share one forward pass instead of competing for the CPU. While a
+    batch is embedded the next one fills up. Only for models embedding queries
+    and documents alike, as the HuggingFace and OpenAI ones do.
+    """
+
+    def __init__(
+        self, embedding_model: Embeddings, max_batch_size: int, max_wait_ms: float
+    ):
+        """
+        :param embedding_model: the underlying embedding model.
+        :param max_batch_size: most queries embedded in one call.
+        :param max_wait_ms: longest wait for more queries after the first one.
+        """
+        self.embedding_model = embedding_model
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+
+        self.batches = 0
+        self.queries = 0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embedding_model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        future = Future()
+        self._start()
+        self._queue.put((text, future))
+
+        return future.result()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="query-embedding-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait_seconds
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    # past the deadline, still take the queries already queued
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._embed(batch)
+
+    def _embed(self, batch: list):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+
+        try:
+            vectors = dict(zip(texts, self.embedding_model.embed_documents(texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.queries += len(batch)
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+    def stats(self) -> dict:
+        """
+        Number of batches and their average size.
+
+        :return:
+        """
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "average_batch_size": (
+                round(self.queries / self.batches, 2) if self.batches else 0.0
+            ),
+        }
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that caches vectors by (model name, text hash).
+
+    Lookups go through an in-memory LRU tier first and then an on-disk SQLite
+    store, so identical chunks and repeated queries are only embedded once.
+    """
+
+    def __init__(
+        self,
+        embedding_model: Embeddings,
+        model_name: str,
+        cache_path: str,
+        memory_items: int = 10000,
+        max_entries: int = 200000,
+    ):
+        """
+        :param embedding_model: the underlying embedding model.
+        :param model_name: model name used to namespace the cache keys.
+        :param cache_path: path of the SQLite cache file.
+        :param memory_items: number of vectors kept in the in-memory tier.
+        :param max_entries: maximum number of vectors kept on disk.
+        """
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.memory_items = memory_items
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+            "ON embeddings (last_access)"
+        )
+        self._connection.commit()
+        self._disk_entries = self._connection.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "document", self.embedding_model.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(
+            [text],
+            "query",
+            lambda texts: [self.embedding_model.embed_query(texts[0])],
+        )[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several queries in one call of the model, cached as queries.
+
+        :param texts:
+        :return:
+        """
+        return self._embed(texts, "query", self.embedding_model.embed_documents)
+
+    def stats(self) -> dict:
+        """
+        Cache hit/miss counters.
+
+        :return:
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model": self.model_name,
+            "memory_hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_entries,
+        }
+
+    def _key(self, namespace: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{namespace}:{digest}"
+
+    def _embed(self, texts: List[str], namespace: str, embed_function):
+        keys = [self._key(namespace, text) for text in texts]
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+
+        with self._lock:
+            missing = []
+            for index, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    vectors[index] = vector
+                else:
+                    missing.append(index)
+
+            if missing:
+                found = self._read_disk([keys[index] for index in missing])
+                still_missing = []
+                for index in missing:
+                    vector = found.get(keys[index])
+                    if vector is not None:
+                        self.disk_hits += 1
+                        vectors[index] = vector
+                        self._remember(keys[index], vector)
+                    else:
+                        still_missing.append(index)
+                missing = still_missing
+
+        if not missing:
+            return vectors
+
+        # embed each distinct text only once
+        unique = {}
+        for index in missing:
+            unique.setdefault(keys[index], texts[index])
+        embedded = embed_function(list(unique.values()))
+        new_vectors = {
+            key: [float(value) for value in vector]
+            for key, vector in zip(unique.keys(), embedded)
+        }
+
+        with self._lock:
+            self.misses += len(missing)
+            for key, vector in new_vectors.items():
+                self._remember(key, vector)
+            self._write_disk(new_vectors)
+
+        for index in missing:
+            vectors[index] = new_vectors[keys[index]]
+
+        return vectors
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, keys: List[str]) -> dict:
+        found = {}
+        now = time.time()
+
+        # stay below the SQLite host parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                batch,
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+
+        if found:
+            self._connection.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            self._connection.commit()
+
+        return found
+
+    def _write_disk(self, vectors: dict):
+        now = time.time()
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+            [
+                (key, array("f", vector).tobytes(), now)
+                for key, vector in vectors.items()
+            ],
+        )
+        self._connection.commit()
+        self._disk_entries += len(vectors)
+
+        if self._disk_entries > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        # drop the least recently used vectors down to 90% of the limit
+        target = int(self.max_entries * 0.9)
+        self._disk_entries = self._connection.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()[0]
+        excess = self._disk_entries - target
+        if excess <= 0:
+            return
+
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,),
+        )
+        self._connection.commit()
+        self._disk_entries -= excess
+        print(f"Embedding cache evicted {excess} entries.")
@@ -0,0 +1,212 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+_word_pattern = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+(?:\.\d+)?")
+_identifier_part_pattern = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercase word tokens. Identifiers such as class or function names are kept
+    whole and also split into their camelCase / snake_case parts.
+
+    :param text:
+    :return:
+    """
+    tokens = []
+
+    for word in _word_pattern.findall(text):
+        tokens.append(word.lower())
+
+        parts = _identifier_part_pattern.findall(word)
+        if len(parts) > 1:
+            tokens += [part.lower() for part in parts]
+
+    return tokens
+
+
+class LexicalIndex:
+    """
+    Incremental BM25 inverted index stored in SQLite.
+
+    Postings are kept in a WITHOUT ROWID table clustered by term, so a query term
+    reads one contiguous range of (term id, document id, term frequency) rows.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        """
+        :param path: path of the SQLite index file.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS terms (
+                term_id INTEGER PRIMARY KEY,
+                term TEXT NOT NULL UNIQUE,
+                df INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term_id INTEGER NOT NULL,
+                doc_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term_id, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+            """)
+        self._connection.commit()
+
+    def add(self, chunk_ids: list[str], texts: list[str]):
+        """
+        Index chunks, replacing any previous version of the same chunk ids.
+
+        :param chunk_ids:
+        :param texts:
+        :return:
+        """
+        with self._lock:
+            self._delete(chunk_ids)
+
+            for chunk_id, text in zip(chunk_ids, texts):
+                term_counts = Counter(tokenize(text))
+                doc_id = self._connection.execute(
+                    "INSERT INTO documents (chunk_id, length) VALUES (?, ?)",
+                    (chunk_id, sum(term_counts.values())),
+                ).lastrowid
+
+                self._connection.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1) "
+                    "ON CONFLICT (term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in term_counts],
+                )
+                term_ids = self._get_term_ids(list(term_counts))
+                self._connection.executemany(
+                    "INSERT INTO postings (term_id, doc_id, tf) VALUES (?, ?, ?)",
+                    [
+                        (term_ids[term], doc_id, count)
+                        for term, count in term_counts.items()
+                    ],
+                )
+
+            self._connection.commit()
+
+    def delete(self, chunk_ids: list[str]):
+        with self._lock:
+            self._delete(chunk_ids)
+            self._connection.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM documents"
+            ).fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._connection.executescript(
+                "DELETE FROM postings; DELETE FROM documents; DELETE FROM terms;"
+            )
+            self._connection.commit()
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """
+        BM25 search.
+
+        :param query:
+        :param k: number of results.
+        :return: (chunk id, score) pairs, best first.
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return []
+
+        with self._lock:
+            doc_count, total_length = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents"
+            ).fetchone()
+            if not doc_count:
+                return []
+            average_length = total_length / doc_count
+
+            placeholders = ",".join("?" * len(query_terms))
+            terms = self._connection.execute(
+                f"SELECT term_id, df FROM terms WHERE term IN ({placeholders})",
+                list(query_terms),
+            ).fetchall()
+
+            scores = Counter()
+            for term_id, df in terms:
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                postings = self._connection.execute(
+                    "SELECT p.doc_id, p.tf, d.length FROM postings p "
+                    "JOIN documents d ON d.doc_id = p.doc_id WHERE p.term_id = ?",
+                    (term_id,),
+                )
+                for doc_id, tf, length in postings:
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = scores.most_common(k)
+            if not best:
+                return []
+
+            placeholders = ",".join("?" * len(best))
+            chunk_ids = dict(
+                self._connection.execute(
+                    f"SELECT doc_id, chunk_id FROM documents WHERE doc_id IN ({placeholders})",
+                    [doc_id for doc_id, _ in best],
+                ).fetchall()
+            )
+
+        return [(chunk_ids[doc_id], score) for doc_id, score in best]
+
+    def _get_term_ids(self, terms: list[str]) -> dict:
+        term_ids = {}
+
+        # stay below the SQLite host parameter limit
+        for start in range(0, len(terms), 500):
+            batch = terms[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            term_ids.update(
+                self._connection.execute(
+                    f"SELECT term, term_id FROM terms WHERE term IN ({placeholders})",
+                    batch,
+                ).fetchall()
+            )
+
+        return term_ids
+
+    def _delete(self, chunk_ids: list[str]):
+        for chunk_id in chunk_ids:
+            row = self._connection.execute(
+                "SELECT doc_id FROM documents WHERE chunk_id = ?", (chunk_id,)
+            ).fetchone()
+            if not row:
+                continue
+
+            doc_id = row[0]
+            self._connection.execute(
+                "UPDATE terms SET df = df - 1 WHERE term_id IN "
+                "(SELECT term_id FROM postings WHERE doc_id = ?)",
+                (doc_id,),
+            )
+            self._connection.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            self._connection.execute(
+                "DELETE FROM documents WHERE doc_id = ?", (doc_id,)
+            )
+
+        self._connection.execute("DELETE FROM terms WHERE df <= 0")
@@ -1,3 +1,6 @@
+import math
+
+import httpx
 from langchain_ollama import ChatOllama
 from langchain_huggingface import (
     HuggingFaceEmbeddings,
@@ -7,56 +10,258 @@ from langchain_huggingface import (
 from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
 
+from common.admission import AdmissionController, AdmittedEmbeddings
+from common.embedding_batcher import MicroBatchedEmbeddings
+from common.embedding_cache import CachedEmbeddings
+
+# ingestion batch limits per embedding backend: a local model uses all the cores
+# on one large batch, a remote API gains from a few concurrent requests
+EMBEDDING_BATCH_LIMITS = {
+    "huggingface": {"max_chunks": 64, "max_chars": 128000, "concurrency": 1},
+    "openai": {"max_chunks": 512, "max_chars": 500000, "concurrency": 4},
+}
+
+# calls running at once per backend: a local server or model is saturated by a
+# few, a remote API serves many
+CONCURRENCY_LIMITS = {
+    "llm": {"ollama": 4, "huggingface": 8, "openai": 32},
+    "embeddings": {"huggingface": 2, "openai": 16},
+}
+
+# queries embedded together by the micro-batcher: a local model on the CPU gains
+# from one forward pass per batch, a remote API serves single queries concurrently
+QUERY_BATCH_SIZES = {"huggingface": 32, "openai": 1}
+
+# pooled HTTP clients shared by the models of the same backend, per pool size
+_http_clients = {}
+
 
 def get_embedding_model(
     embedding_type: str = "openai",
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+    admission: AdmissionController = None,
+    query_batch_size: int = 0,
+    query_batch_wait_ms: float = 5.0,
 ):
     """
     decide which embedding model to use
 
     :param embedding_model:
     :param embedding_type:
+    :param admission: controller bounding the concurrent embedding calls, if any.
+    :param query_batch_size: queries embedded together, 0 uses the default of the
+    backend and 1 embeds every query on its own.
+    :param query_batch_wait_ms: longest wait for more queries to batch.
     :return:
     """
     # Decide which embedding model to use
     if embedding_type == "openai":
-        return get_openai_embedding(embedding_model=embedding_model)
+        model = get_openai_embedding(
+            embedding_model=embedding_model,
+            max_connections=admission.max_concurrent if admission else None,
+        )
     elif embedding_type == "huggingface":
-        return get_huggingface_embedding(embedding_model=embedding_model)
+        model = get_huggingface_embedding(embedding_model=embedding_model)
     else:
         raise ValueError(f"Unsupported embedding: {embedding_model}")
 
+    if admission:
+        model = AdmittedEmbeddings(model, admission)
+
+    query_batch_size = query_batch_size or QUERY_BATCH_SIZES.get(embedding_type, 1)
+    if query_batch_size > 1:
+        model = MicroBatchedEmbeddings(model, query_batch_size, query_batch_wait_ms)
 
-def get_llm(llm_type: str, model_name: str, local_server: str):
+    return model
+
+
+def get_admission_controller(
+    backend: str,
+    backend_type: str,
+    max_concurrent: int = 0,
+    max_waiting: int = 64,
+    max_wait_seconds: float = 30.0,
+) -> AdmissionController:
+    """
+    admission controller of a backend, sized for its type unless max_concurrent is set
+
+    :param backend: llm or embeddings.
+    :param backend_type: openai, huggingface or ollama.
+    :param max_concurrent: calls running at once, 0 uses the default of the backend type.
+    :param max_waiting: calls waiting for a slot.
+    :param max_wait_seconds: longest wait for a slot.
+    :return:
+    """
+    return AdmissionController(
+        backend=f"{backend_type} {backend}",
+        max_concurrent=max_concurrent
+        or CONCURRENCY_LIMITS[backend].get(backend_type, 4),
+        max_waiting=max_waiting,
+        max_wait_seconds=max_wait_seconds,
+    )
+
+
+def get_http_clients(max_connections: int = None):
+    """
+    pooled sync and async HTTP clients, shared by the models with the same pool size
+
+    :param max_connections: connections kept per client, unbounded if None.
+    :return: (httpx.Client, httpx.AsyncClient)
+    """
+    if max_connections not in _http_clients:
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        _http_clients[max_connections] = (
+            httpx.Client(limits=limits),
+            httpx.AsyncClient(limits=limits),
+        )
+
+    return _http_clients[max_connections]
+
+
+def get_embedding_batch_limits(
+    embedding_type: str,
+    max_chunks: int = 0,
+    max_chars: int = 0,
+    concurrency: int = 0,
+) -> dict:
+    """
+    ingestion batch limits of an embedding backend, overridden by non-zero values
+
+    :param embedding_type:
+    :param max_chunks: maximum number of chunks per batch.
+    :param max_chars: maximum number of characters per batch.
+    :param concurrency: maximum number of batches embedded and written at once.
+    :return:
+    """
+    limits = dict(
+        EMBEDDING_BATCH_LIMITS.get(
+            embedding_type, {"max_chunks": 32, "max_chars": 64000, "concurrency": 1}
+        )
+    )
+    overrides = {
+        "max_chunks": max_chunks,
+        "max_chars": max_chars,
+        "concurrency": concurrency,
+    }
+    limits.update({name: value for name, value in overrides.items() if value > 0})
+
+    return limits
+
+
+def get_cached_embedding_model(
+    embedding_type: str,
+    embedding_model: str,
+    cache_path: str,
+    memory_items: int = 10000,
+    max_entries: int = 200000,
+    admission: AdmissionController = None,
+    query_batch_size: int = 0,
+    query_batch_wait_ms: float = 5.0,
+):
+    """
+    embedding model wrapped with a persistent content-hash cache
+
+    :param embedding_type:
+    :param embedding_model:
+    :param cache_path:
+    :param memory_items:
+    :param max_entries:
+    :param admission: controller bounding the embedding calls, cache hits bypass it.
+    :param query_batch_size: queries embedded together, cache misses only.
+    :param query_batch_wait_ms:
+    :return:
+    """
+    return CachedEmbeddings(
+        embedding_model=get_embedding_model(
+            embedding_type,
+            embedding_model,
+            admission=admission,
+            query_batch_size=query_batch_size,
+            query_batch_wait_ms=query_batch_wait_ms,
+        ),
+        model_name=f"{embedding_type}/{embedding_model}",
+        cache_path=cache_path,
+        memory_items=memory_items,
+        max_entries=max_entries,
+    )
+
+
+def get_llm(
+    llm_type: str, model_name: str, local_server: str, max_connections: int = None
+):
     """
     decide which LLM to use
 
     :param local_server:
     :param model_name:
     :param llm_type:
+    :param max_connections: HTTP connections kept to the backend, unbounded if None.
     :return:
     """
     # Decide which llm to use
     if llm_type == "openai":
-        return get_openai_llm(model_name=model_name)
+        return get_openai_llm(model_name=model_name, max_connections=max_connections)
     elif llm_type == "huggingface":
         return get_hugging_face_llm(model_name=model_name)
     elif llm_type == "ollama":
-        return get_ollama_llm(model_name=model_name, local_server=local_server)
+        return get_ollama_llm(
+            model_name=model_name,
+            local_server=local_server,
+            max_connections=max_connections,
+        )
     else:
         raise ValueError(f"Unsupported llm: {llm_type}")
 
 
+def get_token_counter(llm_type: str, model_name: str):
+    """
+    token counter of an LLM, 4 characters per token when its tokenizer is not available
+
+    :param llm_type:
+    :param model_name:
+    :return: function counting the tokens of a text.
+    """
+    # optional dependencies, loaded on first use
+    try:
+        if llm_type == "openai":
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        elif llm_type == "huggingface":
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception as e:
+        print(f"Tokenizer of {model_name} is not available ({e}), approximating.")
+
+    return lambda text: math.ceil(len(text) / 4)
+
+
 def get_openai_embedding(
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+    max_connections: int = None,
 ):
     """
     OpenAI embedding model
 
     :return:
     """
-    return OpenAIEmbeddings()  # default embedding model
+    http_client, http_async_client = get_http_clients(max_connections)
+
+    # default embedding model
+    return OpenAIEmbeddings(
+        http_client=http_client, http_async_client=http_async_client
+    )
 
 
 def get_huggingface_embedding(
@@ -70,13 +275,20 @@ def get_huggingface_embedding(
     return HuggingFaceEmbeddings(model_name=embedding_model)
 
 
-def get_openai_llm(model_name: str):
+def get_openai_llm(model_name: str, max_connections: int = None):
     """
 
     :param model_name:
+    :param max_connections:
     :return:
     """
-    return ChatOpenAI(model_name=model_name)
+    http_client, http_async_client = get_http_clients(max_connections)
+
+    return ChatOpenAI(
+        model_name=model_name,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
 
 
 def get_hugging_face_llm(model_name: str):
@@ -86,17 +298,25 @@ def get_hugging_face_llm(model_name: str):
     :param model_name:
     :return:
     """
+    # the endpoint creates its own inference clients, they cannot be shared
     llm = HuggingFaceEndpoint(repo_id=model_name)
 
     return ChatHuggingFace(llm=llm)
 
 
-def get_ollama_llm(model_name: str, local_server: str):
+def get_ollama_llm(model_name: str, local_server: str, max_connections: int = None):
     """
 
     :param local_server:
     :param model_name:
+    :param max_connections:
     :return:
     """
+    # ChatOllama builds its own clients, only their pool can be sized
+    limits = httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections
+    )
 
-    return ChatOllama(model=model_name, base_url=local_server)
+    return ChatOllama(
+        model=model_name, base_url=local_server, client_kwargs={"limits": limits}
+    )
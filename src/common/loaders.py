@@ -1,10 +1,15 @@
+import asyncio
+import multiprocessing
 import os
 import re
 import pdfplumber
 import camelot
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 from bs4 import BeautifulSoup
-from typing import List
+from typing import AsyncIterator, List
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     TextLoader,
@@ -13,6 +18,9 @@ from langchain_community.document_loaders import (
 )
 from langchain_core.documents import Document
 
+from common.table_cache import PageTableCache
+from config import config
+
 chunk_size = 1000
 overlap = 200
 
@@ -23,138 +31,338 @@ text_splitter = RecursiveCharacterTextSplitter(
     is_separator_regex=False,
 )
 
+_process_pool = None
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by the CPU-bound PDF extraction.
 
-async def load_pdf(pdf_path: str) -> List[Document]:
+    The application already runs threads when the pool starts, and a process
+    forked from it could inherit a lock held by one of them, so the workers come
+    from a forkserver that preloads only this module (or are spawned where there
+    is none). Each worker still imports the application entrypoint once when it
+    starts, not for every task, as the pool lives as long as the application.
     """
-    Extracts text from a PDF file, splits the text from each page into chunks, and returns a list of text chunks.
+    global _process_pool
+
+    if _process_pool is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context("forkserver")
+            mp_context.set_forkserver_preload([__name__])
+        else:
+            mp_context = multiprocessing.get_context("spawn")
+
+        _process_pool = ProcessPoolExecutor(
+            max_workers=config.ingestion.pdf_workers,
+            mp_context=mp_context,
+        )
+
+    return _process_pool
+
+
+async def _run_in_process_pool(function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_process_pool(), function, *args)
+
+
+async def load_pdf(pdf_path: str) -> AsyncIterator[Document]:
+    """
+    Extracts text from a PDF file, splits the text from each page into chunks, and yields the text chunks page by page.
 
     :param pdf_path: Path to the PDF file.
-    :return: List of text chunks extracted from the PDF.
+    :return: Text chunks extracted from the PDF.
     """
     if not os.path.isfile(pdf_path):
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
-    # Load the file
+    # Load the file page by page
     loader = PyPDFLoader(pdf_path)
-    documents = await loader.aload()
+    chunk_count = 0
 
-    # Split the text into chunks
-    text_chunks = text_splitter.split_documents(documents)
-    print(
-        f"Extracted and split text into {len(text_chunks)} chunks from PDF: {pdf_path}"
-    )
+    async for document in loader.alazy_load():
+        # Split the text into chunks
+        for chunk in text_splitter.split_documents([document]):
+            chunk_count += 1
+            yield chunk
 
-    return text_chunks
+    print(f"Extracted and split text into {chunk_count} chunks from PDF: {pdf_path}")
 
 
-async def load_pdf_with_tables(pdf_path: str) -> List[Document]:
+async def load_pdf_with_tables(pdf_path: str) -> AsyncIterator[Document]:
     """
-    Extracts text from a PDF file, splits the text from each page into chunks, and returns a list of text chunks.
+    Extracts text and tables from a PDF file, splits the text from each page into chunks, and yields the chunks in
+    page order as the pages are parsed.
 
     :param pdf_path: Path to the PDF file.
-    :return: List of text chunks extracted from the PDF.
+    :return: Text and table chunks extracted from the PDF.
     """
     if not os.path.isfile(pdf_path):
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
-    documents = []
+    in_flight = deque()
+    table_cache = None
+    chunk_count = 0
 
     try:
-        text_chunks = await _extract_text_from_pdf(pdf_path)
-        tables_chunks = await _extract_tables_from_pdf(pdf_path)
-
-        all_texts = text_chunks + tables_chunks
-
-        # Convert combined_content to list[Document]
-        documents = [
-            Document(
-                page_content=item["content"],  # Main content (text or table)
-                metadata={  # Add metadata
-                    "type": item["type"],
-                    "page": item["page"],
-                    "source": item["source"],
-                },
+        shards = await _get_page_shards(pdf_path)
+        table_cache = await _open_table_cache(pdf_path)
+
+        # a bounded window of shards is extracted concurrently: text and table
+        # candidates first, then camelot on the candidate pages only
+        window = max(config.ingestion.pdf_workers, 1)
+
+        for first, last in shards:
+            in_flight.append(
+                asyncio.create_task(
+                    _extract_shard_from_pdf(pdf_path, first, last, table_cache)
+                )
             )
-            for item in all_texts
-        ]
+            if len(in_flight) < window:
+                continue
+
+            for chunk in _split_pdf_items(await in_flight.popleft()):
+                chunk_count += 1
+                yield chunk
+
+        while in_flight:
+            for chunk in _split_pdf_items(await in_flight.popleft()):
+                chunk_count += 1
+                yield chunk
     except Exception as e:
+        # a partial parse must not be mistaken for the complete document
         print(e)
+        raise
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if table_cache:
+            await asyncio.to_thread(table_cache.save)
+
+    print(f"Extracted {chunk_count} text and table chunks from PDF: {pdf_path}")
+
+
+def _split_pdf_items(items: list[dict]) -> List[Document]:
+    """
+    Convert the extracted items of a shard to Documents, in page order with the
+    text of a page before its tables. Text is split into chunks, tables are kept whole.
+
+    :param items:
+    :return:
+    """
+    documents = []
+
+    for item in sorted(items, key=lambda item: item["page"]):
+        document = Document(
+            page_content=item["content"],  # Main content (text or table)
+            metadata={  # Add metadata
+                "type": item["type"],
+                "page": item["page"],
+                "source": item["source"],
+            },
+        )
+
+        if item["type"] == "text":
+            documents += text_splitter.split_documents([document])
+        else:
+            documents.append(document)
 
     return documents
 
 
-async def _extract_text_from_pdf(pdf_path: str):
+async def _get_page_shards(pdf_path: str) -> List[tuple[int, int]]:
+    """
+    Split the pages of a PDF into ranges of consecutive pages.
+
+    :param pdf_path: Path to the PDF file.
+    :return: List of (first page, last page) ranges, 1-based and inclusive.
+    """
+    page_count = await _run_in_process_pool(_count_pdf_pages, pdf_path)
+    shard_size = max(config.ingestion.pdf_pages_per_shard, 1)
+
+    return [
+        (first_page, min(first_page + shard_size - 1, page_count))
+        for first_page in range(1, page_count + 1, shard_size)
+    ]
+
+
+def _count_pdf_pages(pdf_path: str) -> int:
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+async def _open_table_cache(pdf_path: str) -> PageTableCache:
+    return await asyncio.to_thread(
+        PageTableCache,
+        pdf_path,
+        os.path.join(config.vector_store.data_path, "table_cache"),
+        config.ingestion.table_cache_max_files,
+    )
+
+
+async def _extract_shard_from_pdf(
+    pdf_path: str, first_page: int, last_page: int, table_cache: PageTableCache
+):
+    text_chunks, table_pages = await _run_in_process_pool(
+        _extract_text_from_pages, pdf_path, first_page, last_page
+    )
+    tables_chunks = await _extract_tables_from_candidate_pages(
+        pdf_path, table_pages, table_cache
+    )
+
+    return text_chunks + tables_chunks
+
+
+def _extract_text_from_pages(pdf_path: str, first_page: int, last_page: int):
+    """
+    Extract the text of a page range and detect the pages likely to hold tables.
+
+    :param pdf_path: Path to the PDF file.
+    :param first_page:
+    :param last_page:
+    :return: text chunks and the table candidate page numbers.
+    """
     text_chunks = []
+    table_pages = []
+
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_number in range(first_page, last_page + 1):
+            page = pdf.pages[page_number - 1]
+
+            # Extract text
+            text = page.extract_text()
+            if text:
+                text_chunks.append(
+                    {
+                        "content": text,
+                        "type": "text",
+                        "page": page_number,
+                        "source": pdf_path,
+                    }
+                )
+
+            if _is_table_candidate(page):
+                table_pages.append(page_number)
+
+    return text_chunks, table_pages
+
+
+def _detect_table_pages(pdf_path: str, first_page: int, last_page: int):
+    with pdfplumber.open(pdf_path) as pdf:
+        return [
+            page_number
+            for page_number in range(first_page, last_page + 1)
+            if _is_table_candidate(pdf.pages[page_number - 1])
+        ]
 
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_number, page in enumerate(pdf.pages, start=1):
-                # Extract text
-                text = page.extract_text()
-                if text:
-                    text_chunks.append(
-                        {
-                            "content": text,
-                            "type": "text",
-                            "page": page_number,
-                            "source": pdf_path,
-                        }
-                    )
-    except Exception as e:
-        raise e
 
-    return text_chunks
+def _is_table_candidate(page) -> bool:
+    """
+    Cheap table-likelihood check: camelot (lattice) only finds tables drawn with
+    ruling lines, so pages without enough horizontal and vertical edges are skipped.
+
+    :param page: pdfplumber page.
+    :return:
+    """
+    min_lines = config.ingestion.table_min_ruling_lines
+    horizontal = 0
+    vertical = 0
+
+    for edge in page.edges:
+        if edge["orientation"] == "h":
+            horizontal += 1
+        else:
+            vertical += 1
+
+        if horizontal >= min_lines and vertical >= min_lines:
+            return True
+
+    return False
 
 
 async def _extract_tables_from_pdf(pdf_path: str):
-    tables_as_text = []
+    shards = await _get_page_shards(pdf_path)
+    table_cache = await _open_table_cache(pdf_path)
+    shard_pages = await asyncio.gather(
+        *(
+            _run_in_process_pool(_detect_table_pages, pdf_path, first, last)
+            for first, last in shards
+        )
+    )
+    results = await asyncio.gather(
+        *(
+            _extract_tables_from_candidate_pages(pdf_path, table_pages, table_cache)
+            for table_pages in shard_pages
+        )
+    )
+    await asyncio.to_thread(table_cache.save)
+
+    return [table for shard_tables in results for table in shard_tables]
 
-    try:
-        # Extract all tables from all pages at once
-        tables = camelot.read_pdf(pdf_path, pages="all")
-
-        for table in tables:
-            table_text = table.df.to_markdown()  # Convert table to Markdown
-            tables_as_text.append(
-                {
-                    "content": table_text.strip(),
-                    "type": "table",
-                    "page": table.page,
-                    "source": pdf_path,
-                }
-            )
-    except Exception as e:
-        raise e
 
-    return tables_as_text
+async def _extract_tables_from_candidate_pages(
+    pdf_path: str, table_pages: List[int], table_cache: PageTableCache
+):
+    # camelot only runs on the candidate pages it has not seen yet
+    missing_pages = [page for page in table_pages if table_cache.get(page) is None]
 
+    if missing_pages:
+        extracted = await _run_in_process_pool(
+            _extract_tables_from_pages, pdf_path, missing_pages
+        )
+        for page in missing_pages:
+            table_cache.put(page, extracted.get(page, []))
 
-async def load_text_file(file_path: str) -> List[Document]:
+    return [
+        {
+            "content": table_text,
+            "type": "table",
+            "page": page,
+            "source": pdf_path,
+        }
+        for page in table_pages
+        for table_text in table_cache.get(page)
+    ]
+
+
+def _extract_tables_from_pages(pdf_path: str, pages: List[int]):
+    tables_by_page = {}
+
+    tables = camelot.read_pdf(pdf_path, pages=",".join(map(str, pages)))
+
+    for table in tables:
+        table_text = table.df.to_markdown()  # Convert table to Markdown
+        tables_by_page.setdefault(int(table.page), []).append(table_text.strip())
+
+    return tables_by_page
+
+
+async def load_text_file(file_path: str) -> AsyncIterator[Document]:
     """
-    Extracts text from a plain text file, splits it into chunks, and returns a list of text chunks.
+    Extracts text from a plain text file, splits it into chunks, and yields the text chunks.
 
     :param file_path: Path to the text file.
-    :return: List of text chunks extracted from the text file.
+    :return: Text chunks extracted from the text file.
     """
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"Text file not found: {file_path}")
 
     # Load the file
     loader = TextLoader(file_path)
-    documents = await loader.aload()
+    chunk_count = 0
 
-    # Split the text into chunks
-    text_chunks = text_splitter.split_documents(documents)
-    print(
-        f"Extracted and split text into {len(text_chunks)} chunks from file: {file_path}"
-    )
+    async for document in loader.alazy_load():
+        # Split the text into chunks
+        for chunk in text_splitter.split_documents([document]):
+            chunk_count += 1
+            yield chunk
 
-    return text_chunks
+    print(f"Extracted and split text into {chunk_count} chunks from file: {file_path}")
 
 
-async def load_web_url(root_url: str) -> List[Document]:
+async def load_web_url(root_url: str) -> AsyncIterator[Document]:
     """
-    Extracts text from a web urls text file, splits it into chunks, and returns a list of text chunks.
+    Extracts text from web pages under a root url, splits it into chunks, and yields the text chunks page by page.
 
     :param root_url:
     :return:
@@ -170,12 +378,12 @@ async def load_web_url(root_url: str) -> List[Document]:
     )
 
     print("Collecting documents from web pages.....")
-    documents = await pages.aload()
+    chunk_count = 0
 
-    # Split the text into chunks
-    text_chunks = text_splitter.split_documents(documents)
-    print(
-        f"Extracted and split text into {len(text_chunks)} chunks from urls: {root_url}"
-    )
+    async for document in pages.alazy_load():
+        # Split the text into chunks
+        for chunk in text_splitter.split_documents([document]):
+            chunk_count += 1
+            yield chunk
 
-    return text_chunks
+    print(f"Extracted and split text into {chunk_count} chunks from urls: {root_url}")
@@ -0,0 +1,57 @@
+import json
+import os
+
+
+class SourceManifest:
+    """
+    Per-collection record of the chunk ids stored for every ingested source.
+
+    It lets re-ingestion embed only new chunks, delete the ones that
+    disappeared and skip files whose content digest did not change.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the JSON manifest file.
+        """
+        self.path = path
+        self.sources = {}
+
+        if os.path.isfile(path):
+            with open(path, "r") as file:
+                self.sources = json.load(file).get("sources", {})
+
+    def get_ids(self, source: str) -> list[str]:
+        return self.sources.get(source, {}).get("ids", [])
+
+    def get_digest(self, source: str):
+        return self.sources.get(source, {}).get("digest")
+
+    def is_unchanged(self, source: str, digest: str) -> bool:
+        """
+        Check if the source was already ingested with the same content digest.
+
+        :param source:
+        :param digest:
+        :return:
+        """
+        return bool(self.get_ids(source)) and self.get_digest(source) == digest
+
+    def update(self, source: str, ids, digest: str = None):
+        self.sources[source] = {"digest": digest, "ids": sorted(ids)}
+
+    def remove(self, source: str):
+        self.sources.pop(source, None)
+
+    def clear(self):
+        self.sources = {}
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        # write to a temporary file first so a crash never leaves half a manifest
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"sources": self.sources}, file)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,38 @@
+import re
+
+# whole messages that need no retrieval
+_small_talk_pattern = re.compile(
+    r"^(hi|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|great|nice|yes|no|bye|"
+    r"goodbye|good (morning|afternoon|evening|night)|how are you)\b[\s!.?,]*"
+    r"(there|again|a lot|so much|very much)?[\s!.?]*$"
+)
+# words referring to earlier turns, the LLM rewrites such questions into a standalone query
+_follow_up_pattern = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|their|he|she|him|her|above|"
+    r"previous|earlier|same|more|else|also|again|one)\b"
+)
+_follow_up_start_pattern = re.compile(r"^(and|or|but|so|what about|how about|why)\b")
+
+
+def classify_query(query: str, has_history: bool) -> str:
+    """
+    Decide locally whether a question goes straight to retrieval.
+
+    Small talk and short follow-ups referring to the conversation are left to the
+    LLM, which answers directly or rewrites them into a standalone query.
+
+    :param query:
+    :param has_history: whether the conversation has earlier turns.
+    :return: retrieve or llm.
+    """
+    text = " ".join(query.lower().split())
+    if not text or _small_talk_pattern.match(text):
+        return "llm"
+
+    if has_history and (
+        _follow_up_start_pattern.match(text)
+        or (len(text.split()) <= 8 and _follow_up_pattern.search(text))
+    ):
+        return "llm"
+
+    return "retrieve"
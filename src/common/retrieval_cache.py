@@ -0,0 +1,78 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+class RetrievalCache:
+    """
+    LRU cache of retrieval results keyed by (collection, normalized query, k, filters).
+
+    Every entry records the generation of its collection when it was searched; a
+    result from an older generation is never returned.
+    """
+
+    def __init__(self, max_entries: int):
+        """
+        :param max_entries: maximum number of cached results.
+        """
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(collection: str, query: str, k: int, filters: dict = None) -> tuple:
+        normalized_query = " ".join(query.lower().split())
+        return (
+            collection,
+            normalized_query,
+            k,
+            json.dumps(filters, sort_keys=True, default=str),
+        )
+
+    def get(self, key: tuple, generation: int):
+        """
+        Cached documents of a search, if the collection did not change since.
+
+        :param key:
+        :param generation: current generation of the collection.
+        :return: the documents or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] != generation:
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, key: tuple, generation: int, documents: list):
+        with self._lock:
+            self._entries[key] = (generation, list(documents))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,218 @@
+import asyncio
+import contextlib
+import math
+import time
+from collections import defaultdict, deque
+
+from common.admission import AdmissionRejected
+
+PRIORITIES = ("interactive", "batch")
+
+
+class _Flow:
+    """
+    Requests of one user in one priority class, oldest first.
+    """
+
+    def __init__(self, user_id: str, priority: str, weight: float):
+        self.user_id = user_id
+        self.priority = priority
+        self.weight = weight
+        self.last_finish = 0.0
+        self.waiters = deque()  # (finish tag, future, enqueue time)
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing of the generation requests across users.
+
+    Every (user, priority class) pair is a flow. A request is tagged with a
+    virtual finish time advancing by 1 / weight per request of its flow, and the
+    waiting request with the smallest tag runs next (self-clocked fair queuing),
+    so a user sending many requests only delays their own. The weight of a flow
+    is the weight of its class times the weight of the user; a user never runs
+    more than the per-user cap at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        per_user_concurrency: int,
+        max_queued_per_user: int,
+        priority_weights: dict,
+        user_weights: dict = None,
+    ):
+        """
+        :param max_concurrent: requests running at once.
+        :param per_user_concurrency: requests of one user running at once.
+        :param max_queued_per_user: requests of one user waiting, beyond are rejected.
+        :param priority_weights: weight of every priority class.
+        :param user_weights: weight of some users, 1 for the others.
+        """
+        self.max_concurrent = max_concurrent
+        self.per_user_concurrency = per_user_concurrency
+        self.max_queued_per_user = max_queued_per_user
+        self.priority_weights = priority_weights
+        self.user_weights = user_weights or {}
+
+        self.virtual_time = 0.0
+        self.running = 0
+        self.user_running = defaultdict(int)
+        self.user_queued = defaultdict(int)
+        self.flows = {}
+
+        self.rejected = 0
+        self.service_seconds = 1.0
+        # recent waits per priority class, for the percentiles
+        self.waits = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id: str, priority: str = "interactive"):
+        """
+        Wait for the turn of a request and hold it while the request runs.
+
+        :param user_id:
+        :param priority: interactive or batch.
+        :return:
+        """
+        future = self._enqueue(user_id, priority)
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the turn was granted meanwhile, hand it to the next request
+                self._release(user_id, 0.0)
+            else:
+                self._withdraw(user_id, priority, future)
+            raise
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(user_id, time.perf_counter() - started)
+
+    def check(self, user_id: str):
+        """
+        Reject now if the queue of the user is full, before a response starts.
+
+        :param user_id:
+        :return:
+        """
+        if self.user_queued.get(user_id, 0) >= self.max_queued_per_user:
+            self.rejected += 1
+            retry_after = (
+                self.user_queued[user_id]
+                * self.service_seconds
+                / self.per_user_concurrency
+            )
+            raise AdmissionRejected(
+                f"generation queue of {user_id}", max(1, math.ceil(retry_after))
+            )
+
+    def _enqueue(self, user_id: str, priority: str) -> asyncio.Future:
+        self.check(user_id)
+
+        flow = self.flows.get((user_id, priority))
+        if flow is None:
+            flow = _Flow(
+                user_id,
+                priority,
+                self.priority_weights[priority] * self.user_weights.get(user_id, 1.0),
+            )
+            self.flows[(user_id, priority)] = flow
+
+        # an idle flow restarts at the current virtual time, it gets no credit
+        finish = max(self.virtual_time, flow.last_finish) + 1 / flow.weight
+        flow.last_finish = finish
+
+        future = asyncio.get_running_loop().create_future()
+        flow.waiters.append((finish, future, time.perf_counter()))
+        self.user_queued[user_id] += 1
+
+        return future
+
+    def _withdraw(self, user_id: str, priority: str, future: asyncio.Future):
+        # a request cancelled while waiting leaves the queue
+        flow = self.flows.get((user_id, priority))
+        if flow is None:
+            return
+
+        for waiter in flow.waiters:
+            if waiter[1] is future:
+                flow.waiters.remove(waiter)
+                self.user_queued[user_id] -= 1
+                if not self.user_queued[user_id]:
+                    del self.user_queued[user_id]
+                break
+
+    def _dispatch(self):
+        # start the eligible requests with the smallest finish tags
+        while self.running < self.max_concurrent:
+            best = None
+            for flow in list(self.flows.values()):
+                if not flow.waiters:
+                    if flow.last_finish <= self.virtual_time:
+                        del self.flows[(flow.user_id, flow.priority)]
+                    continue
+                if self.user_running.get(flow.user_id, 0) >= self.per_user_concurrency:
+                    continue
+                if best is None or flow.waiters[0][0] < best.waiters[0][0]:
+                    best = flow
+
+            if best is None:
+                return
+
+            finish, future, enqueued = best.waiters.popleft()
+            self.user_queued[best.user_id] -= 1
+            self.user_running[best.user_id] += 1
+            self.running += 1
+            self.virtual_time = max(self.virtual_time, finish)
+            self.waits[best.priority].append(time.perf_counter() - enqueued)
+            future.set_result(None)
+
+    def _release(self, user_id: str, held_seconds: float):
+        self.running -= 1
+        self.user_running[user_id] -= 1
+        if not self.user_running[user_id]:
+            del self.user_running[user_id]
+        if not self.user_queued.get(user_id, 1):
+            del self.user_queued[user_id]
+
+        self.service_seconds = 0.8 * self.service_seconds + 0.2 * held_seconds
+        self._dispatch()
+
+    def stats(self) -> dict:
+        """
+        Queue depth and wait time percentiles per priority class.
+
+        :return:
+        """
+        queued = defaultdict(int)
+        for flow in self.flows.values():
+            queued[flow.priority] += len(flow.waiters)
+
+        stats = {
+            "running": self.running,
+            "max_concurrent": self.max_concurrent,
+            "users_running": len(self.user_running),
+            "rejected": self.rejected,
+        }
+        for priority in PRIORITIES:
+            waits = sorted(self.waits[priority])
+            stats[priority] = {
+                "queued": queued[priority],
+                "wait_p50_seconds": _percentile(waits, 0.5),
+                "wait_p99_seconds": _percentile(waits, 0.99),
+            }
+
+        return stats
+
+
+def _percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+
+    return round(values[min(len(values) - 1, int(len(values) * fraction))], 4)
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Cache of past answers per collection, looked up by query embedding similarity.
+
+    Each collection keeps a small flat index of normalized query vectors; entries
+    expire after a TTL and the least recently used ones are evicted first.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl_seconds: float):
+        """
+        :param threshold: minimum cosine similarity for a cached answer to be reused.
+        :param max_entries: maximum number of entries per collection.
+        :param ttl_seconds: lifetime of an entry.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+        self._collections = {}  # collection -> OrderedDict(query -> entry)
+        self._indexes = {}  # collection -> (queries, matrix)
+        self._lock = threading.Lock()
+
+    def lookup(self, collection: str, query_vector: list[float]):
+        """
+        Find the cached entry most similar to the query, if above the threshold.
+
+        :param collection:
+        :param query_vector:
+        :return: the cached entry or None.
+        """
+        with self._lock:
+            self._expire(collection)
+            queries, matrix = self._get_index(collection)
+
+            entry = None
+            if queries:
+                similarities = matrix @ _normalize(query_vector)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entries = self._collections[collection]
+                    entry = entries[queries[best]]
+                    entries.move_to_end(queries[best])
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.latency_saved += entry["latency"]
+            return entry
+
+    def put(
+        self,
+        collection: str,
+        query: str,
+        query_vector: list[float],
+        answer: str,
+        sources: list,
+        latency: float,
+    ):
+        """
+        Store an answer.
+
+        :param collection:
+        :param query: the standalone query that was answered.
+        :param query_vector:
+        :param answer:
+        :param sources: metadata of the documents the answer is based on.
+        :param latency: seconds it took to produce the answer.
+        :return:
+        """
+        with self._lock:
+            entries = self._collections.setdefault(collection, OrderedDict())
+            entries[query] = {
+                "query": query,
+                "vector": _normalize(query_vector),
+                "answer": answer,
+                "sources": sources,
+                "latency": latency,
+                "created": time.monotonic(),
+            }
+            entries.move_to_end(query)
+
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+            self._indexes.pop(collection, None)
+
+    def invalidate(self, collection: str):
+        """
+        Drop all the answers of a collection, e.g. after new documents were ingested.
+
+        :param collection:
+        :return:
+        """
+        with self._lock:
+            self._collections.pop(collection, None)
+            self._indexes.pop(collection, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+            "entries": {
+                collection: len(entries)
+                for collection, entries in self._collections.items()
+            },
+        }
+
+    def _expire(self, collection: str):
+        entries = self._collections.get(collection)
+        if not entries:
+            return
+
+        deadline = time.monotonic() - self.ttl_seconds
+        expired = [
+            query for query, entry in entries.items() if entry["created"] < deadline
+        ]
+        for query in expired:
+            del entries[query]
+
+        if expired:
+            self._indexes.pop(collection, None)
+
+    def _get_index(self, collection: str):
+        # the matrix is rebuilt lazily, only after the entries changed
+        if collection not in self._indexes:
+            entries = self._collections.get(collection, {})
+            queries = list(entries.keys())
+            matrix = (
+                np.vstack([entries[query]["vector"] for query in queries])
+                if queries
+                else None
+            )
+            self._indexes[collection] = (queries, matrix)
+
+        return self._indexes[collection]
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm else vector
@@ -0,0 +1,120 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Hashable
+
+
+class _Stream:
+    """
+    Chunks of one shared stream, replayed to every subscriber.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+        self.producer = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller of a key runs the
+    work, the callers arriving while it runs share its result.
+
+    The work runs in its own task, so a caller that disconnects does not cancel
+    it for the others. A key is forgotten as soon as its work finishes; results
+    are not cached.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable]):
+        """
+        Run the work of a key, or wait for the run already in flight.
+
+        :param key:
+        :param function: coroutine function doing the work.
+        :return: the result of the shared run.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(function())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.followers += 1
+
+        return await asyncio.shield(task)
+
+    async def stream(
+        self, key: Hashable, function: Callable[[], AsyncIterator]
+    ) -> AsyncIterator:
+        """
+        Subscribe to the stream of a key, started if none is in flight. A late
+        subscriber first receives the chunks already produced.
+
+        :param key:
+        :param function: function returning the async iterator of the chunks.
+        :return:
+        """
+        stream = self._streams.get(key)
+        if stream is None:
+            self.leaders += 1
+            stream = _Stream()
+            self._streams[key] = stream
+            # keep the producer referenced, the loop only holds a weak reference
+            stream.producer = asyncio.ensure_future(
+                self._produce(key, stream, function())
+            )
+        else:
+            self.followers += 1
+
+        position = 0
+        while True:
+            async with stream.changed:
+                await stream.changed.wait_for(
+                    lambda: stream.done or len(stream.chunks) > position
+                )
+
+            while position < len(stream.chunks):
+                yield stream.chunks[position]
+                position += 1
+
+            if stream.done and position == len(stream.chunks):
+                if stream.error is not None:
+                    raise stream.error
+                return
+
+    async def _produce(self, key: Hashable, stream: _Stream, chunks: AsyncIterator):
+        try:
+            async for chunk in chunks:
+                async with stream.changed:
+                    stream.chunks.append(chunk)
+                    stream.changed.notify_all()
+        except Exception as err:
+            stream.error = err
+        finally:
+            self._streams.pop(key, None)
+            async with stream.changed:
+                stream.done = True
+                stream.changed.notify_all()
+            stream.producer = None
+
+    def stats(self) -> dict:
+        """
+        Number of calls that ran the work and calls that shared it.
+
+        :return:
+        """
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalesced_rate": self.followers / total if total else 0.0,
+        }
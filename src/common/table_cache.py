@@ -0,0 +1,75 @@
+import contextlib
+import json
+import os
+
+from common import utils
+
+
+class PageTableCache:
+    """
+    Tables extracted from a PDF, cached per page and keyed by the file digest.
+
+    Pages without tables are cached too, so camelot never runs twice on a page
+    of the same file. The directory keeps the max_files most recently used PDFs.
+    """
+
+    def __init__(self, pdf_path: str, cache_dir: str, max_files: int = 1000):
+        """
+        :param pdf_path: Path to the PDF file.
+        :param cache_dir: directory holding one JSON file per PDF digest.
+        :param max_files: number of PDFs kept, the least recently used are deleted.
+        """
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.path = os.path.join(cache_dir, f"{utils.file_digest(pdf_path)}.json")
+        self.pages = {}
+        self.changed = False
+
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as file:
+                self.pages = json.load(file)
+            # the modification time records the last use
+            os.utime(self.path)
+
+    def get(self, page: int):
+        """
+        Cached tables of a page, or None if the page was never extracted.
+
+        :param page:
+        :return:
+        """
+        return self.pages.get(str(page))
+
+    def put(self, page: int, tables: list[str]):
+        self.pages[str(page)] = tables
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.pages, file)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+        self._evict()
+
+    def _evict(self):
+        # delete the least recently used PDFs beyond max_files
+        entries = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith(".json") and entry.is_file():
+                    entries.append((entry.stat().st_mtime, entry.path))
+
+        excess = len(entries) - self.max_files
+        if excess <= 0:
+            return
+
+        for _, path in sorted(entries)[:excess]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        print(f"Deleted the cached tables of {excess} PDFs.")
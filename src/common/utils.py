@@ -1,16 +1,54 @@
-def format_context(documents, truncate: bool = True):
+import hashlib
+
+
+def source_tag(metadata: dict) -> str:
+    """
+    compact reference of a chunk, e.g. [report.pdf p.3 table]
+
+    :param metadata:
+    :return:
+    """
+    parts = [str(metadata.get("source", "unknown"))]
+    if metadata.get("page") is not None:
+        parts.append(f"p.{metadata['page']}")
+    if metadata.get("type") == "table":
+        parts.append("table")
+    if metadata.get("collection"):
+        parts.append(f"({metadata['collection']})")
+
+    return f"[{' '.join(parts)}]"
+
+
+def format_document(document) -> str:
+    """
+    chunk content preceded by its source tag
+
+    :param document:
+    :return:
+    """
+    return f"{source_tag(document.metadata)}\n{document.page_content}"
+
+
+def format_context(documents):
     """
-    reformat document to String
+    reformat documents to String
 
-    :param truncate:
     :param documents:
     :return:
     """
-    # Use only the top 1 or 2 most relevant documents
-    context = "\n\n---\n\n ".join([doc.page_content for doc in documents])
+    return "\n\n".join(format_document(document) for document in documents)
 
-    # Truncate the context if it exceeds max_length
-    if len(context) > 500 and truncate:
-        context = context[:500]
 
-    return context
+def file_digest(path: str) -> str:
+    """
+    sha256 digest of a file content
+
+    :param path:
+    :return:
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
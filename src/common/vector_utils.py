@@ -1,6 +1,8 @@
 import os
 import shutil
 
+import chromadb
+import numpy as np
 from langchain_chroma import Chroma
 
 
@@ -8,6 +10,7 @@ def get_vector_store(
     data_path,
     embedding_model,
     collection_name: str = "default",
+    client=None,
 ):
     """
     decide which vector store to use
@@ -15,6 +18,7 @@ def get_vector_store(
     :param collection_name:
     :param data_path:
     :param embedding_model:
+    :param client: shared vector store client, created if omitted.
     :return:
     """
 
@@ -22,18 +26,39 @@ def get_vector_store(
         data_path=data_path,
         embedding_model=embedding_model,
         collection_name=collection_name,
+        client=client,
     )
 
 
-def get_chroma_instance(data_path, embedding_model, collection_name: str = "default"):
+def get_vector_store_client(data_path):
+    """
+    Persistent client that can be shared by the handles of all collections.
+
+    :param data_path:
+    :return:
+    """
+    return chromadb.PersistentClient(path=data_path)
+
+
+def get_chroma_instance(
+    data_path, embedding_model, collection_name: str = "default", client=None
+):
     """
     Initialize Chroma vector store.
 
     :param collection_name:
     :param data_path:
     :param embedding_model:
+    :param client: shared Chroma client, created if omitted.
     :return:
     """
+    if client is not None:
+        return Chroma(
+            client=client,
+            embedding_function=embedding_model,
+            collection_name=collection_name,
+        )
+
     return Chroma(
         persist_directory=data_path,
         embedding_function=embedding_model,
@@ -50,3 +75,50 @@ def clear_database(path: str):
     if os.path.exists(path):
         shutil.rmtree(path)
         print(f"Data path {path} deleted!")
+
+
+def maximal_marginal_relevance(
+    query_embedding,
+    embeddings,
+    k: int,
+    lambda_mult: float = 0.5,
+    relevance=None,
+) -> list[int]:
+    """
+    Select diverse yet relevant embeddings, vectorized with NumPy.
+
+    :param query_embedding:
+    :param embeddings: candidate embeddings, one per row.
+    :param k: number of candidates to select.
+    :param lambda_mult: 1 for pure relevance, 0 for maximum diversity.
+    :param relevance: relevance scores overriding the query cosine similarity.
+    :return: indices of the selected candidates, in selection order.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if not len(embeddings):
+        return []
+
+    embeddings = embeddings / np.maximum(
+        np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12
+    )
+    if relevance is None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        relevance = embeddings @ (query / max(np.linalg.norm(query), 1e-12))
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    similarity = embeddings @ embeddings.T
+    # highest similarity of every candidate to the selected ones
+    redundancy = np.zeros(len(embeddings), dtype=np.float32)
+    available = np.ones(len(embeddings), dtype=bool)
+    selected = []
+
+    for _ in range(min(k, len(embeddings))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+
+    return selected
@@ -10,6 +10,7 @@ load_dotenv()
 class VectorStoreConfig(BaseSettings):
     data_path: str
     resource_path: str
+    max_open_collections: int = 16
 
 
 class LlmConfig(BaseSettings):
@@ -18,17 +19,122 @@ class LlmConfig(BaseSettings):
     llm_name: str
     api_key: str
     local_server: str
+    # token budget of the retrieved context in the prompt
+    context_max_tokens: int = 3000
+    # chunks overlapping an already packed one by this much are dropped
+    context_duplicate_threshold: float = 0.9
+    # LLM calls running at once (0 uses the default of the backend), waiting and
+    # the longest wait before a request is rejected with 429
+    max_concurrent: int = 0
+    max_waiting: int = 64
+    max_wait_seconds: float = 30.0
 
 
 class Embeddings(BaseSettings):
     embedding_model: str
     embedding_type: str
+    cache_enabled: bool = True
+    cache_memory_items: int = 10000
+    cache_max_entries: int = 200000
+    executor_workers: int = 4
+    # ingestion batches, 0 uses the default of the embedding backend
+    batch_max_chunks: int = 0
+    batch_max_chars: int = 0
+    batch_concurrency: int = 0
+    retry_attempts: int = 3
+    retry_backoff_seconds: float = 1.0
+    # embedding calls running at once (0 uses the default of the backend), waiting
+    # and the longest wait before a request is rejected with 429
+    max_concurrent: int = 0
+    max_waiting: int = 256
+    max_wait_seconds: float = 10.0
+    # concurrent query embeddings batched together (0 uses the default of the
+    # backend, 1 turns it off), waiting at most this long for more queries
+    query_batch_size: int = 0
+    query_batch_wait_ms: float = 5.0
+
+
+class IngestionConfig(BaseSettings):
+    workers: int = 2
+    max_jobs_kept: int = 1000
+    pdf_workers: int = os.cpu_count() or 1
+    pdf_pages_per_shard: int = 16
+    table_min_ruling_lines: int = 2
+    table_cache_max_files: int = 1000
+    queue_size: int = 8
+    stream_batch_size: int = 64
+
+
+class RetrievalConfig(BaseSettings):
+    k: int = 8
+    fetch_k: int = 40
+    mmr_enabled: bool = True
+    mmr_lambda: float = 0.7
+    # optional local cross-encoder, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+    rerank_model: str = ""
+    # similarity or hybrid (dense + BM25 with reciprocal rank fusion)
+    search_type: str = "hybrid"
+    rrf_k: int = 60
+    cache_max_entries: int = 1024
+    # search the raw question while the LLM writes the retrieval query, reused
+    # when the query is this similar to the question
+    speculative: bool = True
+    speculation_threshold: float = 0.9
+    # federated search leaves out the collections slower than this
+    collection_timeout_seconds: float = 5.0
+
+
+class SemanticCacheConfig(BaseSettings):
+    enabled: bool = False
+    threshold: float = 0.92
+    max_entries: int = 1000
+    ttl_seconds: int = 3600
+
+
+class RoutingConfig(BaseSettings):
+    # llm (the LLM decides), rules (local rules, the LLM for the rest) or always
+    mode: str = "rules"
+
+
+class ConversationConfig(BaseSettings):
+    # sqlite (persistent) or memory
+    checkpointer: str = "sqlite"
+    hot_threads: int = 1000
+    idle_ttl_seconds: int = 604800
+    max_messages: int = 40
+    # identical questions asked at the same time share one answer
+    coalesce_identical: bool = True
+
+
+class SchedulerConfig(BaseSettings):
+    enabled: bool = True
+    # requests generated at once, 0 uses the concurrency of the LLM backend
+    max_concurrent: int = 0
+    per_user_concurrency: int = 2
+    max_queued_per_user: int = 32
+    # share of the backend of the x-priority classes, and of some users
+    interactive_weight: float = 4.0
+    batch_weight: float = 1.0
+    user_weights: dict[str, float] = {}
+
+
+class BatchConfig(BaseSettings):
+    max_queries: int = 1000
+    # answers of one batch generated at once
+    max_concurrent: int = 8
 
 
 class AppConfig(BaseSettings):
     vector_store: VectorStoreConfig
     llms: LlmConfig
     embeddings: Embeddings
+    ingestion: IngestionConfig = IngestionConfig()
+    retrieval: RetrievalConfig = RetrievalConfig()
+    semantic_cache: SemanticCacheConfig = SemanticCacheConfig()
+    conversation: ConversationConfig = ConversationConfig()
+    routing: RoutingConfig = RoutingConfig()
+    scheduler: SchedulerConfig = SchedulerConfig()
+    batch: BatchConfig = BatchConfig()
 
     class Config:
         env_file = "/.env"  # Specify the path to your .env file
@@ -1,11 +1,16 @@
 from typing_extensions import Optional, List, TypedDict
 
 from langchain_core.documents import Document
+from langgraph.graph import MessagesState
 from pydantic import BaseModel
 
 
 class QuestionAnswerRequest(BaseModel):
     query: str
+    # collection to answer from, the default collection if omitted
+    collection: Optional[str] = None
+    # search these collections together instead of a single one
+    collections: Optional[List[str]] = None
 
 
 class QuestionAnswerResponse(BaseModel):
@@ -15,9 +20,47 @@ class QuestionAnswerResponse(BaseModel):
     source: Optional[list] = None
 
 
+class BatchQuestionAnswerRequest(BaseModel):
+    # standalone questions, answered without conversation history
+    queries: List[str]
+    collection: Optional[str] = None
+    collections: Optional[List[str]] = None
+
+
+class BatchQuestionAnswerResponse(QuestionAnswerResponse):
+    # position of the question in the request, answers arrive as they complete
+    index: int
+    error: Optional[str] = None
+
+
+class IngestJob(BaseModel):
+    id: str
+    collection: str
+    source: str
+    # queued, parsing, embedding, writing, done or failed
+    state: str = "queued"
+    chunks_parsed: int = 0
+    chunks_added: int = 0
+    chunks_unchanged: int = 0
+    chunks_stale: int = 0
+    chunks_per_second: Optional[float] = None
+    searchable_after_seconds: Optional[float] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
 class State(TypedDict):
     user_id: str
     question: str
     documents: List[Document]
     answer: str
     history: list
+
+
+class ConversationState(MessagesState):
+    # collection the current question is answered from
+    collection: str
+    # collections searched together for the current question, if any
+    collections: Optional[List[str]]
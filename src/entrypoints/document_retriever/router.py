@@ -1,26 +1,42 @@
+import asyncio
 import shutil
 
-from fastapi.background import BackgroundTasks
-
-from adapter import document_retriever, llm_service
-from common import loaders
+from adapter import document_retriever
+from common import loaders, utils
 from config import config
 
-from fastapi import UploadFile, File, APIRouter, HTTPException, status
+from fastapi import UploadFile, File, APIRouter, HTTPException, Query, status
 from fastapi.responses import JSONResponse
 
 router = APIRouter(tags=["Document-Retriever"])
 
 
 @router.get("/similarity-search")
-def similarity_search(query: str):
+async def similarity_search(
+    query: str, collection: str = None, collections: list[str] = Query(None)
+):
     """
 
     :param query:
+    :param collection: collection to search, defaults to the default collection.
+    :param collections: search these collections concurrently instead, "*" for all.
     :return:
     """
-    # get similarities
-    documents = document_retriever.retrieve(query)
+    if collections:
+        if "*" in collections:
+            collections = [c.name for c in document_retriever.get_collection_list()]
+
+        # get similarities across collections
+        documents = await document_retriever.afederated_retrieve(
+            query, [_get_collection_name(name) for name in collections]
+        )
+    else:
+        collection = _get_collection_name(collection)
+
+        # get similarities
+        documents = await document_retriever.aretrieve(
+            query, collection_name=collection
+        )
 
     # Extract document fields and score into a dictionary
     response_data = [
@@ -37,6 +53,15 @@ def similarity_search(query: str):
     )
 
 
+@router.get("/cache-stats")
+async def cache_stats():
+    """
+
+    :return: hit/miss statistics of the retrieval and embedding caches.
+    """
+    return JSONResponse(content=document_retriever.cache_stats())
+
+
 @router.post("/load-pdf")
 async def load_pdf(file: UploadFile = File(...)):
     file_path = f"{config.vector_store.resource_path}/{file.filename}"
@@ -50,13 +75,14 @@ async def load_pdf(file: UploadFile = File(...)):
 
 
 @router.post("/add-document")
-async def add_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def add_document(file: UploadFile = File(...), collection: str = None):
     """
 
-    :param background_tasks:
     :param file:
+    :param collection: target collection, defaults to the default collection.
     :return:
     """
+    collection = _get_collection_name(collection, create=True)
     file_path = f"{config.vector_store.resource_path}/{file.filename}"
     file_extension = file.filename.split(".")[-1]
 
@@ -74,49 +100,67 @@ async def add_document(background_tasks: BackgroundTasks, file: UploadFile = Fil
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"The file extension is not valid.: {file_extension}",
         )
-    # Schedule background processing
-    background_tasks.add_task(_process_document, file_extension, file_path)
+    # Queue the ingestion job
+    job = await _process_document(file_extension, file_path, collection)
+    if job is None:
+        return JSONResponse(
+            content={"message": "Document is unchanged, nothing to ingest."},
+            status_code=status.HTTP_200_OK,
+        )
 
     return JSONResponse(
         content={
-            "message": "Documents extraction ongoing.  Document embedding ongoing and will be available in a while."
+            "message": "Documents extraction ongoing.  Document embedding ongoing and will be available in a while.",
+            "job_id": job.id,
         },
         status_code=status.HTTP_202_ACCEPTED,
     )
 
 
 @router.post("/add-web-pages")
-async def add_web_pages(background_tasks: BackgroundTasks, root_url: str):
+async def add_web_pages(root_url: str, collection: str = None):
     """
 
     :param root_url:
-    :param background_tasks:
+    :param collection: target collection, defaults to the default collection.
     :return:
     """
-    # Schedule background processing
-    background_tasks.add_task(_process_document, "html", root_url)
+    collection = _get_collection_name(collection, create=True)
+
+    # Queue the ingestion job
+    job = await _process_document("html", root_url, collection)
 
     return JSONResponse(
         content={
-            "message": "Webpages extraction ongoing.  Document embedding ongoing and will be available in a while."
+            "message": "Webpages extraction ongoing.  Document embedding ongoing and will be available in a while.",
+            "job_id": job.id,
         },
         status_code=status.HTTP_202_ACCEPTED,
     )
 
 
-async def _process_document(file_extension: str, path: str):
+async def _process_document(file_extension: str, path: str, collection: str = None):
     """
 
     :param file_extension:
     :param path:
-    :return:
+    :param collection:
+    :return: the queued job, None if the document is unchanged.
     """
+    # skip files that were already ingested with the same content
+    digest = None
+    if file_extension in ("txt", "pdf"):
+        digest = await asyncio.to_thread(utils.file_digest, path)
+        if document_retriever.is_source_unchanged(path, digest, collection):
+            print(f"Document {path} is unchanged, skipping.")
+            return None
+
     if "txt" in file_extension:
-        documents = await loaders.load_text_file(file_path=path)
+        documents = loaders.load_text_file(file_path=path)
     elif "pdf" in file_extension:
-        documents = await loaders.load_pdf_with_tables(pdf_path=path)
+        documents = loaders.load_pdf_with_tables(pdf_path=path)
     elif "html" in file_extension:
-        documents = await loaders.load_web_url(path)
+        documents = loaders.load_web_url(path)
     else:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -124,18 +168,52 @@ async def _process_document(file_extension: str, path: str):
         )
 
     print(f"Document {path} adding to the queue.")
-    await document_retriever.add_documents(documents)
+    return await document_retriever.add_documents(
+        documents, digest, collection, source=path
+    )
+
+
+@router.get("/ingest-jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """
+
+    :param job_id:
+    :return: state, chunk counts and throughput of an ingestion job.
+    """
+    job = document_retriever.get_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Ingestion job not found: {job_id}",
+        )
+
+    return JSONResponse(content=job.model_dump())
+
+
+def _get_collection_name(collection: str = None, create: bool = False) -> str:
+    """
+    Open the requested collection, resolving the default one now so queued jobs
+    do not follow a later switch.
+
+    :param collection:
+    :param create: create the collection if it does not exist, for ingestion.
+    :return: the collection name.
+    """
+    try:
+        return document_retriever.get_collection(collection, create=create).name
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
 @router.post("/switch-collection")
 async def create_collection(collection_name: str):
-    # init collection
-    collection = document_retriever.get_or_create_collection(
-        collection_name=collection_name
-    )
-
-    # init llm
-    llm_service.init_llm()
+    # open the collection and use it for requests that do not name one
+    try:
+        collection = document_retriever.get_or_create_collection(
+            collection_name=collection_name
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return JSONResponse(content={"collection": collection})
 
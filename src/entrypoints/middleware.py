@@ -1,12 +1,16 @@
 import time
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+from common.admission import AdmissionRejected
 
 from starlette.middleware.base import RequestResponseEndpoint
 
 
 def configure(app: FastAPI) -> None:
     app.middleware("http")(_add_process_time_header)
+    app.add_exception_handler(AdmissionRejected, _reject_saturated)
     app.add_middleware(
         CORSMiddleware,
         # The type ignores below are resolved in a newer version of mypy.
@@ -27,3 +31,12 @@ async def _add_process_time_header(
     response.headers["X-Process-Time"] = str(process_time)
 
     return response
+
+
+async def _reject_saturated(request: Request, exc: AdmissionRejected) -> Response:
+    # fail fast while a backend is saturated, the client retries later
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
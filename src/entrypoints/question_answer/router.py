@@ -1,41 +1,188 @@
+from typing import Literal
+
 from starlette.responses import StreamingResponse
 
-from domain.model import QuestionAnswerRequest
-from fastapi import APIRouter, Header
+from adapter import document_retriever, llm_service, semantic_cache
+from domain.model import BatchQuestionAnswerRequest, QuestionAnswerRequest
+from config import config
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import JSONResponse
 from manager import chat_manager
 
 router = APIRouter(tags=["Question-Answer"])
 
 
 @router.post("/generate")
-async def generate(request: QuestionAnswerRequest, x_user_id: str = Header(...)):
+async def generate(
+    request: QuestionAnswerRequest,
+    x_user_id: str = Header(...),
+    x_priority: Literal["interactive", "batch"] = Header("interactive"),
+):
     """
 
     :param x_user_id:
+    :param x_priority: scheduling class, batch requests yield to interactive ones.
     :param request:
     :return:
     """
+    _validate_collections(request.collection, request.collections)
+
     # get answer from LLM (final format)
-    response = await chat_manager.process_message(x_user_id, request.query)
+    response = await chat_manager.process_message(
+        x_user_id,
+        request.query,
+        request.collection,
+        request.collections,
+        x_priority,
+    )
 
     return "\n".join(response.splitlines())
 
 
 @router.post("/generate-stream")
-async def generate_stream(request: QuestionAnswerRequest, x_user_id: str = Header(...)):
+async def generate_stream(
+    request: QuestionAnswerRequest,
+    x_user_id: str = Header(...),
+    x_priority: Literal["interactive", "batch"] = Header("interactive"),
+):
     """
 
     :param x_user_id:
+    :param x_priority: scheduling class, batch requests yield to interactive ones.
     :param request:
     :return:
     """
-    # get answer from LLM (final format)
-    response = await chat_manager.process_message(x_user_id, request.query)
+    _validate_collections(request.collection, request.collections)
+
+    # a saturated LLM can only be reported before the response starts
+    llm_service.admission.check()
+    chat_manager.scheduler.check(x_user_id)
+
+    # forward the answer tokens as the LLM generates them
+    return StreamingResponse(
+        chat_manager.stream_message(
+            x_user_id,
+            request.query,
+            request.collection,
+            request.collections,
+            x_priority,
+        ),
+        media_type="text/plain",
+    )
+
+
+@router.post("/generate-batch")
+async def generate_batch(
+    request: BatchQuestionAnswerRequest,
+    x_user_id: str = Header(...),
+    x_priority: Literal["interactive", "batch"] = Header("batch"),
+):
+    """
+
+    :param x_user_id:
+    :param x_priority: scheduling class of the answers.
+    :param request: standalone questions, answered without conversation history.
+    :return: one JSON answer per line (NDJSON), in completion order.
+    """
+    if len(request.queries) > config.batch.max_queries:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {config.batch.max_queries} queries per batch.",
+        )
+
+    _validate_collections(request.collection, request.collections)
+
+    # a saturated LLM can only be reported before the response starts
+    llm_service.admission.check()
+
+    async def answers():
+        async for answer in chat_manager.process_batch(
+            x_user_id,
+            request.queries,
+            request.collection,
+            request.collections,
+            x_priority,
+        ):
+            yield answer.model_dump_json() + "\n"
+
+    return StreamingResponse(answers(), media_type="application/x-ndjson")
+
+
+def _validate_collections(collection: str = None, collections: list[str] = None):
+    """
+    Reject an invalid or unknown collection before answering, instead of
+    creating it.
+
+    :param collection:
+    :param collections: collections searched together, if any.
+    :return:
+    """
+    try:
+        for name in [collection] + (collections or []):
+            document_retriever.get_collection(name)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/semantic-cache-stats")
+async def semantic_cache_stats():
+    """
+
+    :return: hit rate and latency saved by the semantic answer cache.
+    """
+    return JSONResponse(content=semantic_cache.stats())
+
 
-    async def response_generator():
-        # Simulate chunking by splitting the response into lines
-        for line in response.splitlines():
-            yield line + "\n"
+@router.get("/routing-stats")
+async def routing_stats():
+    """
 
-    # Return a StreamingResponse
-    return StreamingResponse(response_generator(), media_type="text/plain")
+    :return: number of questions that skipped the routing LLM call.
+    """
+    return JSONResponse(content=chat_manager.graph_manager.routing_stats())
+
+
+@router.get("/conversation-stats")
+async def conversation_stats():
+    """
+
+    :return: number of stored conversation threads and of the ones kept in memory.
+    """
+    memory = chat_manager.graph_manager.memory
+    stats = {"checkpointer": config.conversation.checkpointer}
+    if hasattr(memory, "stats"):
+        stats.update(memory.stats())
+
+    return JSONResponse(content=stats)
+
+
+@router.get("/coalescing-stats")
+async def coalescing_stats():
+    """
+
+    :return: number of questions answered by sharing the answer of an identical one.
+    """
+    return JSONResponse(content=chat_manager.answer_flights.stats())
+
+
+@router.get("/admission-stats")
+async def admission_stats():
+    """
+
+    :return: calls running, waiting and rejected per backend.
+    """
+    return JSONResponse(
+        content={
+            "llm": llm_service.admission.stats(),
+            "embeddings": document_retriever.embedding_admission.stats(),
+        }
+    )
+
+
+@router.get("/scheduler-stats")
+async def scheduler_stats():
+    """
+
+    :return: queue depth and wait times of the fair-share scheduler per priority class.
+    """
+    return JSONResponse(content=chat_manager.scheduler.stats())
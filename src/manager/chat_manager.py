@@ -1,35 +1,321 @@
+import asyncio
+import contextlib
+import hashlib
+import json
 import uuid
 
+from adapter import document_retriever, llm_service
+from common import utils
+from common.scheduler import FairScheduler
+from common.singleflight import SingleFlight
+from config import config
+from domain.model import BatchQuestionAnswerResponse
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 from manager.graph_manager import GraphManager
 
 
 class ChatManager:
     def __init__(self):
         self.graph_manager = GraphManager()
-        self.user_conversation = {}
+        # identical questions asked at the same time share one answer
+        self.answer_flights = SingleFlight()
+        # users share the LLM fairly, whatever the rate of their requests
+        self.scheduler = FairScheduler(
+            max_concurrent=config.scheduler.max_concurrent
+            or llm_service.admission.max_concurrent,
+            per_user_concurrency=config.scheduler.per_user_concurrency,
+            max_queued_per_user=config.scheduler.max_queued_per_user,
+            priority_weights={
+                "interactive": config.scheduler.interactive_weight,
+                "batch": config.scheduler.batch_weight,
+            },
+            user_weights=config.scheduler.user_weights,
+        )
 
     def get_conversation(self, user_id: str):
-        thread_id = self.user_conversation.get(user_id, None)
-        if not thread_id:
-            thread_id = uuid.uuid4()
-            self.user_conversation[user_id] = thread_id
+        # derived from the user id, so conversations survive restarts without a mapping
+        return uuid.uuid5(uuid.NAMESPACE_URL, f"rag-bot/conversation/{user_id}")
+
+    def _get_input(
+        self, query: str, collection: str = None, collections: list[str] = None
+    ) -> dict:
+        return {
+            "messages": [{"role": "user", "content": query}],
+            # raises a ValueError for an unknown collection rather than creating it
+            "collection": document_retriever.get_collection(collection).name,
+            "collections": collections,
+        }
+
+    async def _get_flight_key(
+        self, graph_client, thread_config: dict, graph_input: dict
+    ) -> tuple:
+        """
+        Key of the questions answered alike: same collections, same normalized
+        question and same recent conversation.
+
+        :param graph_client:
+        :param thread_config:
+        :param graph_input:
+        :return:
+        """
+        state = await graph_client.aget_state(thread_config)
+        history = [
+            [message.type, str(message.content)]
+            for message in state.values.get("messages", [])[-10:]
+            if message.type == "human"
+            or (message.type == "ai" and not message.tool_calls)
+        ]
+        fingerprint = (
+            hashlib.sha256(json.dumps(history).encode("utf-8")).hexdigest()
+            if history
+            else ""
+        )
 
-        return thread_id
+        return (
+            graph_input["collection"],
+            tuple(sorted(set(graph_input["collections"] or []))),
+            " ".join(graph_input["messages"][0]["content"].lower().split()),
+            fingerprint,
+        )
+
+    def _turn(self, user_id: str, priority: str):
+        # wait for the turn of the user, unless the scheduler is off
+        if not config.scheduler.enabled:
+            return contextlib.nullcontext()
+
+        return self.scheduler.slot(user_id, priority)
+
+    async def _record_answer(
+        self, graph_client, thread_config: dict, query: str, answer: str
+    ):
+        # a coalesced question did not run the graph, add the turn to its own conversation
+        await graph_client.aupdate_state(
+            thread_config,
+            {"messages": [HumanMessage(content=query), AIMessage(content=answer)]},
+            as_node="generate_response",
+        )
 
-    async def process_message(self, user_id: str, query: str):
+    async def process_message(
+        self,
+        user_id: str,
+        query: str,
+        collection: str = None,
+        collections: list[str] = None,
+        priority: str = "interactive",
+    ):
         # initialise graph
         graph_client = await self.graph_manager.get_graph()
 
         # get or create new session
         thread_id = self.get_conversation(user_id)
         print(f"Conversation Thread Id: {thread_id}")
-        config = {"configurable": {"thread_id": thread_id}}
+        thread_config = {"configurable": {"thread_id": thread_id}}
+        graph_input = self._get_input(query, collection, collections)
 
-        # execute the graph workflow
-        response = await graph_client.ainvoke(
-            {"messages": [{"role": "user", "content": query}]}, config=config
-        )
+        async def answer():
+            # execute the graph workflow
+            async with self._turn(user_id, priority):
+                response = await graph_client.ainvoke(graph_input, config=thread_config)
+            ai_response = response["messages"][-1]
+
+            return ai_response.content
+
+        if not config.conversation.coalesce_identical:
+            return await answer()
+
+        led = False
+
+        def lead():
+            nonlocal led
+            led = True
+            return answer()
+
+        key = await self._get_flight_key(graph_client, thread_config, graph_input)
+        content = await self.answer_flights.do(("answer",) + key, lead)
+        if not led:
+            await self._record_answer(graph_client, thread_config, query, content)
+
+        return content
+
+    async def stream_message(
+        self,
+        user_id: str,
+        query: str,
+        collection: str = None,
+        collections: list[str] = None,
+        priority: str = "interactive",
+    ):
+        """
+        Stream the answer tokens as the LLM produces them.
+
+        :param user_id:
+        :param query:
+        :param collection: collection to answer from, defaults to the default collection.
+        :param collections: collections searched together instead, if any.
+        :param priority: interactive or batch, for the fair-share scheduler.
+        :return:
+        """
+        # initialise graph
+        graph_client = await self.graph_manager.get_graph()
+
+        # get or create new session
+        thread_id = self.get_conversation(user_id)
+        print(f"Conversation Thread Id: {thread_id}")
+        thread_config = {"configurable": {"thread_id": thread_id}}
+        graph_input = self._get_input(query, collection, collections)
+
+        if not config.conversation.coalesce_identical:
+            async for token in self._stream_answer(
+                user_id, priority, graph_client, thread_config, graph_input
+            ):
+                yield token
+            return
+
+        led = False
+
+        def lead():
+            nonlocal led
+            led = True
+            return self._stream_answer(
+                user_id, priority, graph_client, thread_config, graph_input
+            )
+
+        # identical questions subscribe to the tokens of the first one
+        key = await self._get_flight_key(graph_client, thread_config, graph_input)
+        tokens = []
+        async for token in self.answer_flights.stream(("stream",) + key, lead):
+            tokens.append(token)
+            yield token
+
+        if not led:
+            await self._record_answer(
+                graph_client, thread_config, query, "".join(tokens)
+            )
+
+    async def _stream_answer(
+        self,
+        user_id: str,
+        priority: str,
+        graph_client,
+        thread_config: dict,
+        graph_input: dict,
+    ):
+        async with self._turn(user_id, priority):
+            async for token in self._stream_graph(
+                graph_client, thread_config, graph_input
+            ):
+                yield token
+
+    async def _stream_graph(self, graph_client, thread_config: dict, graph_input: dict):
+        # execute the graph workflow, forwarding the tokens of the answer
+        async for stream_mode, chunk in graph_client.astream(
+            graph_input,
+            config=thread_config,
+            stream_mode=["messages", "updates"],
+        ):
+            if stream_mode == "messages":
+                message, metadata = chunk
+                if metadata.get("langgraph_node") == "generate_response":
+                    if message.content:
+                        yield message.content
+            else:
+                # answered directly without retrieval, by the LLM or from the cache
+                for node in ("route_query", "query_or_respond"):
+                    if not chunk.get(node):
+                        continue
+                    ai_response = chunk[node]["messages"][-1]
+                    if not ai_response.tool_calls and ai_response.content:
+                        yield ai_response.content
+
+    async def process_batch(
+        self,
+        user_id: str,
+        queries: list[str],
+        collection: str = None,
+        collections: list[str] = None,
+        priority: str = "batch",
+    ):
+        """
+        Answer many standalone questions, yielding every answer as soon as it is
+        ready.
+
+        With the embedding cache enabled, the questions are embedded in batched
+        calls ahead of their searches; without it, only the query micro-batcher
+        groups their embeddings. Identical questions are searched and answered
+        once, and at most BATCH__MAX_CONCURRENT answers are generated at once,
+        each in a scheduler turn of the user. The questions do not enter the
+        conversation of the user.
+
+        :param user_id:
+        :param queries:
+        :param collection: collection to answer from, defaults to the default collection.
+        :param collections: collections searched together instead, if any.
+        :param priority: interactive or batch, for the fair-share scheduler.
+        :return: BatchQuestionAnswerResponse per question, in completion order.
+        """
+        collection = document_retriever.get_collection(collection).name
+        collection_label = ",".join(collections) if collections else collection
+
+        # indexes of the questions per normalized question
+        groups = {}
+        for index, query in enumerate(queries):
+            groups.setdefault(" ".join(query.lower().split()), []).append(index)
+        print(f"Batch of {len(queries)} questions, {len(groups)} distinct.")
+
+        # only an optimization: the searches embed their query again on failure
+        try:
+            await document_retriever.aembed_queries(
+                [queries[indexes[0]] for indexes in groups.values()]
+            )
+        except Exception as e:
+            print(f"Batch questions not embedded ahead of their searches: {e!r}")
+
+        semaphore = asyncio.Semaphore(config.batch.max_concurrent)
 
-        ai_response = response["messages"][-1]
+        async def answer(indexes: list[int]):
+            query = queries[indexes[0]]
+            try:
+                async with semaphore:
+                    documents = await self.graph_manager.retrieve(
+                        query, collection, collections
+                    )
+                    async with self._turn(user_id, priority):
+                        response = await llm_service.agenerate_response(
+                            [
+                                HumanMessage(content=query),
+                                ToolMessage(
+                                    content=utils.format_context(documents),
+                                    artifact=documents,
+                                    tool_call_id="batch",
+                                ),
+                            ]
+                        )
+                return indexes, response.content, documents, None
+            except Exception as e:
+                return indexes, None, [], str(e)
 
-        return ai_response.content
+        tasks = [asyncio.create_task(answer(indexes)) for indexes in groups.values()]
+        try:
+            for task in asyncio.as_completed(tasks):
+                indexes, result, documents, error = await task
+                sources = [
+                    {
+                        "source": doc.metadata.get("source"),
+                        "page": doc.metadata.get("page"),
+                        "collection": doc.metadata.get("collection", collection),
+                    }
+                    for doc in documents
+                ]
+                for index in indexes:
+                    yield BatchQuestionAnswerResponse(
+                        index=index,
+                        query=queries[index],
+                        collection=collection_label,
+                        result=result,
+                        source=sources,
+                        error=error,
+                    )
+        finally:
+            # the client went away: stop the answers still pending
+            for task in tasks:
+                task.cancel()
@@ -1,14 +1,47 @@
-from adapter import document_retriever, llm_service
+import asyncio
+import os
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from typing_extensions import Annotated, Optional
+
+from adapter import document_retriever, llm_service, semantic_cache
+from common import utils
+from common.admission import AdmissionRejected
+from common.checkpointer import get_checkpointer
+from common.query_router import classify_query
+from config import config
+from domain.model import ConversationState
+from langchain_core.messages import AIMessage
 from langchain_core.tools import tool
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import StateGraph, END, MessagesState
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.graph import StateGraph, END
+from langgraph.prebuilt import InjectedState, ToolNode, tools_condition
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # a speculation cancelled or never awaited must not log an unretrieved exception
+    if not task.cancelled():
+        task.exception()
 
 
 class GraphManager:
     def __init__(self):
         self.graph = None
-        self.memory = MemorySaver()
+        self.memory = get_checkpointer(
+            checkpointer_type=config.conversation.checkpointer,
+            path=os.path.join(config.vector_store.data_path, "conversations.sqlite3"),
+            hot_threads=config.conversation.hot_threads,
+            idle_ttl_seconds=config.conversation.idle_ttl_seconds,
+            max_messages=config.conversation.max_messages,
+        )
+        # number of questions per retrieval route
+        self.routes = Counter()
+        # question message id -> (retrieval query, speculative search task)
+        self.speculations = OrderedDict()
+        self.speculation_outcomes = Counter()
 
     async def initialize_graph_once(self):
         if not self.graph:
@@ -19,46 +52,131 @@ class GraphManager:
         return self.graph
 
     async def initialize_graph(self):
+        # Step 0: Retrieve directly, without asking the LLM, when the router allows.
+        async def route_query(state: ConversationState):
+            """Decide locally whether to retrieve."""
+            if not await self._is_fast_path(state):
+                self.routes["llm"] += 1
+                return None
+
+            query = state["messages"][-1].content
+            if self._use_semantic_cache(state):
+                cached_response = await self._get_cached_response(
+                    state["collection"], query
+                )
+                if cached_response:
+                    self.routes["semantic_cache"] += 1
+                    return {"messages": [cached_response]}
+
+            self.routes["fast_path"] += 1
+            return {
+                "messages": [
+                    AIMessage(
+                        content="",
+                        tool_calls=[
+                            {
+                                "name": "retrieve_documents",
+                                "args": {"query": query},
+                                "id": f"route_{uuid.uuid4().hex}",
+                            }
+                        ],
+                    )
+                ]
+            }
+
         # Step 1: Generate an AIMessage that may include a tool-call to be sent.
-        def query_or_respond(state: MessagesState):
+        async def query_or_respond(state: ConversationState):
             """Generate tool call for retrieval or respond."""
             llm_with_tools = llm_service.llm.bind_tools([retrieve_documents])
-            response = llm_with_tools.invoke(state["messages"][-10:])
+
+            # search the question itself while the LLM writes the retrieval query
+            speculation = None
+            if config.retrieval.speculative:
+                speculation = asyncio.create_task(
+                    self.retrieve(
+                        state["messages"][-1].content,
+                        state["collection"],
+                        state.get("collections"),
+                    )
+                )
+                speculation.add_done_callback(_retrieve_exception)
+
+            try:
+                async with llm_service.admission.aslot():
+                    response = await llm_with_tools.ainvoke(state["messages"][-10:])
+
+                # answer from the semantic cache instead of retrieving
+                if self._use_semantic_cache(state) and response.tool_calls:
+                    cached_response = await self._get_cached_response(
+                        state["collection"],
+                        response.tool_calls[0]["args"].get("query", ""),
+                    )
+                    if cached_response:
+                        response = cached_response
+
+                if speculation:
+                    await self._keep_speculation(state, response, speculation)
+            except BaseException:
+                if speculation:
+                    speculation.cancel()
+                raise
 
             # MessagesState appends messages to state instead of overwriting
             return {"messages": [response]}
 
         # Step 2: Define the retrieval tool.
         @tool(response_format="content_and_artifact")
-        def retrieve_documents(query: str):
+        async def retrieve_documents(
+            query: str,
+            collection: Annotated[str, InjectedState("collection")],
+            collections: Annotated[Optional[list], InjectedState("collections")],
+            messages: Annotated[list, InjectedState("messages")],
+        ):
             """Retrieve information related to a query.
 
             Args:
                 query - Query string
             """
-            documents = document_retriever.retrieve(query)
-            serialized_documents = "\n\n".join(
-                (f"Source: {doc.metadata}\n" f"Content: {doc.page_content}")
-                for doc in documents
-            )
+            documents = await self._get_speculation(messages, query)
+            if documents is None:
+                documents = await self.retrieve(query, collection, collections)
+            serialized_documents = utils.format_context(documents)
 
             return serialized_documents, documents
 
         # Step 2: Execute the retrieval.
-        tools = ToolNode(tools=[retrieve_documents])
+        tools = ToolNode(
+            tools=[retrieve_documents], handle_tool_errors=self._handle_tool_error
+        )
 
         # Step 3: generate LLM response
-        def generate_response(state: MessagesState):
-            response = llm_service.generate_response(state["messages"][-10:])
+        async def generate_response(state: ConversationState):
+            started = time.perf_counter()
+            response = await llm_service.agenerate_response(state["messages"][-10:])
+
+            if self._use_semantic_cache(state):
+                await self._cache_response(
+                    state["collection"],
+                    state["messages"],
+                    response,
+                    time.perf_counter() - started,
+                )
+
             return {"messages": [response]}
 
         # build grap workflows
-        graph_builder = StateGraph(MessagesState)
+        graph_builder = StateGraph(ConversationState)
+        graph_builder.add_node("route_query", route_query)
         graph_builder.add_node("query_or_respond", query_or_respond)
         graph_builder.add_node("tools", tools)
         graph_builder.add_node("generate_response", generate_response)
 
-        graph_builder.set_entry_point("query_or_respond")
+        graph_builder.set_entry_point("route_query")
+        graph_builder.add_conditional_edges(
+            "route_query",
+            self._after_route,
+            {"tools": "tools", "query_or_respond": "query_or_respond", END: END},
+        )
         graph_builder.add_conditional_edges(
             "query_or_respond",
             tools_condition,
@@ -68,3 +186,211 @@ class GraphManager:
         graph_builder.add_edge("generate_response", END)
 
         return graph_builder.compile(checkpointer=self.memory)
+
+    def _handle_tool_error(self, error: Exception) -> str:
+        # a saturated backend fails the request, other errors are reported to the LLM
+        if isinstance(error, AdmissionRejected):
+            raise error
+
+        return f"Error: {error!r}\n Please fix your mistakes."
+
+    async def retrieve(self, query: str, collection: str, collections: list = None):
+        if collections:
+            return await document_retriever.afederated_retrieve(query, collections)
+
+        return await document_retriever.aretrieve(query, collection_name=collection)
+
+    async def _keep_speculation(self, state: ConversationState, response, speculation):
+        """
+        Keep the speculative search for the retrieval tool if the LLM asked to
+        retrieve a query close to the question, cancel it otherwise.
+
+        :param state:
+        :param response: the routing LLM response.
+        :param speculation: the speculative search task.
+        :return:
+        """
+        question = state["messages"][-1]
+        queries = [
+            tool_call["args"].get("query", "")
+            for tool_call in getattr(response, "tool_calls", None) or []
+        ]
+
+        if len(queries) != 1 or not await self._is_close_query(
+            question.content, queries[0]
+        ):
+            speculation.cancel()
+            self.speculation_outcomes["cancelled"] += 1
+            return
+
+        self.speculations[question.id] = (queries[0], speculation)
+        while len(self.speculations) > 1000:
+            _, (_, stale_speculation) = self.speculations.popitem(last=False)
+            stale_speculation.cancel()
+
+    async def _get_speculation(self, messages: list, query: str):
+        """
+        Result of the speculative search kept for the current question and query.
+
+        :param messages:
+        :param query:
+        :return: the documents, or None if there is no such search.
+        """
+        question_id = next(
+            (message.id for message in reversed(messages) if message.type == "human"),
+            None,
+        )
+        speculative_query, speculation = self.speculations.pop(
+            question_id, (None, None)
+        )
+        if speculation is None:
+            return None
+
+        if speculative_query != query or speculation.cancelled():
+            speculation.cancel()
+            return None
+
+        try:
+            documents = await speculation
+        except Exception:
+            # the retrieval tool searches again
+            return None
+
+        self.speculation_outcomes["reused"] += 1
+        return documents
+
+    async def _is_close_query(self, question: str, query: str) -> bool:
+        if " ".join(question.lower().split()) == " ".join(query.lower().split()):
+            return True
+
+        # without the embedding cache the comparison would cost two embedding calls
+        if not config.embeddings.cache_enabled:
+            return False
+
+        # both embeddings are cached, the query one is needed for retrieval anyway
+        vectors = np.asarray(
+            await asyncio.gather(
+                document_retriever.embedding_model.aembed_query(question),
+                document_retriever.embedding_model.aembed_query(query),
+            ),
+            dtype=np.float32,
+        )
+        norms = np.linalg.norm(vectors, axis=1)
+        if not norms.all():
+            return False
+
+        similarity = float(vectors[0] @ vectors[1] / (norms[0] * norms[1]))
+        return similarity >= config.retrieval.speculation_threshold
+
+    async def _is_fast_path(self, state: ConversationState) -> bool:
+        """
+        Check if the question goes straight to retrieval, skipping the LLM call
+        that decides it.
+
+        :param state:
+        :return:
+        """
+        if config.routing.mode == "always":
+            return True
+        if config.routing.mode != "rules":
+            return False
+
+        messages = state["messages"]
+        if classify_query(messages[-1].content, len(messages) > 1) != "retrieve":
+            return False
+
+        # nothing to retrieve from an empty collection
+        if state.get("collections"):
+            return True
+        return not await asyncio.to_thread(
+            document_retriever.is_collection_empty, state["collection"]
+        )
+
+    def _after_route(self, state: ConversationState) -> str:
+        message = state["messages"][-1]
+        if message.type != "ai":
+            return "query_or_respond"
+
+        return "tools" if message.tool_calls else END
+
+    def routing_stats(self) -> dict:
+        """
+        Number of questions per retrieval route.
+
+        :return:
+        """
+        total = sum(self.routes.values())
+        return {
+            "mode": config.routing.mode,
+            "routes": dict(self.routes),
+            "speculation": dict(self.speculation_outcomes),
+            "fast_path_rate": (
+                (self.routes["fast_path"] + self.routes["semantic_cache"]) / total
+                if total
+                else 0.0
+            ),
+        }
+
+    def _use_semantic_cache(self, state: ConversationState) -> bool:
+        # cached answers are invalidated per collection, federated ones are not cached
+        return config.semantic_cache.enabled and not state.get("collections")
+
+    async def _get_cached_response(self, collection: str, query: str):
+        """
+        Look up a previous answer to a similar standalone query.
+
+        :param collection:
+        :param query:
+        :return: the cached answer as an AIMessage, or None.
+        """
+        query_vector = await document_retriever.embedding_model.aembed_query(query)
+        entry = semantic_cache.lookup(collection, query_vector)
+        if not entry:
+            return None
+
+        print(f"Semantic cache hit: '{query}' matched '{entry['query']}'")
+        return AIMessage(
+            content=entry["answer"],
+            response_metadata={
+                "semantic_cache": entry["query"],
+                "sources": entry["sources"],
+            },
+        )
+
+    async def _cache_response(
+        self, collection: str, messages, response, latency: float
+    ):
+        """
+        Store the answer under the standalone query of the last retrieval.
+
+        :param collection:
+        :param messages:
+        :param response:
+        :param latency:
+        :return:
+        """
+        sources = []
+        for message in reversed(messages):
+            if message.type == "tool":
+                sources += [
+                    {
+                        "source": doc.metadata.get("source"),
+                        "page": doc.metadata.get("page"),
+                    }
+                    for doc in message.artifact or []
+                ]
+            elif message.type == "ai" and message.tool_calls:
+                query = message.tool_calls[0]["args"].get("query", "")
+                break
+        else:
+            return
+
+        query_vector = await document_retriever.embedding_model.aembed_query(query)
+        semantic_cache.put(
+            collection=collection,
+            query=query,
+            query_vector=query_vector,
+            answer=response.content,
+            sources=sources,
+            latency=latency,
+        )
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from common.admission import AdmissionController, AdmissionRejected
+
+
+def _controller(**kwargs) -> AdmissionController:
+    settings = {"max_concurrent": 1, "max_waiting": 1, "max_wait_seconds": 5.0}
+    settings.update(kwargs)
+    return AdmissionController("backend", **settings)
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        admission = _controller()
+        admission.service_seconds = 2.5
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.aslot():
+                await release.wait()
+
+        running = asyncio.create_task(hold())
+        waiting = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+
+        # one call runs and one waits, a third does not fit in the queue
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with admission.aslot():
+                pass
+
+        release.set()
+        await asyncio.gather(running, waiting)
+        return admission, rejected.value
+
+    admission, rejection = asyncio.run(scenario())
+
+    assert rejection.backend == "backend"
+    # two calls ahead of it at 2.5 seconds each
+    assert rejection.retry_after == 5
+    assert admission.stats()["rejected"] == 1
+    assert admission.stats()["admitted"] == 2
+
+
+def test_expected_wait_beyond_the_deadline_is_rejected():
+    async def scenario():
+        admission = _controller(max_waiting=10, max_wait_seconds=1.0)
+        admission.service_seconds = 3.0
+
+        async with admission.aslot():
+            with pytest.raises(AdmissionRejected):
+                admission.check()
+
+    asyncio.run(scenario())
+
+
+def test_released_slot_is_handed_to_the_oldest_waiter():
+    async def scenario():
+        admission = _controller(max_waiting=2)
+        order = []
+        release = asyncio.Event()
+
+        async def call(name: str, wait: bool = False):
+            async with admission.aslot():
+                order.append(name)
+                if wait:
+                    await release.wait()
+
+        first = asyncio.create_task(call("first", wait=True))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(call("second"))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(call("third"))
+        await asyncio.sleep(0)
+
+        assert admission.stats()["waiting"] == 2
+        release.set()
+        await asyncio.gather(first, second, third)
+
+        return admission, order
+
+    admission, order = asyncio.run(scenario())
+
+    assert order == ["first", "second", "third"]
+    assert admission.stats()["active"] == 0
+    assert admission.stats()["waiting"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission = _controller()
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.aslot():
+                await release.wait()
+
+        running = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert admission.stats()["waiting"] == 1
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert admission.stats()["waiting"] == 0
+
+        release.set()
+        await running
+        return admission
+
+    admission = asyncio.run(scenario())
+
+    # the slot was not leaked by the cancelled waiter
+    assert admission.stats()["active"] == 0
+    assert admission.stats()["admitted"] == 1
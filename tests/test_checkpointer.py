@@ -0,0 +1,105 @@
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from common.checkpointer import SqliteCheckpointSaver
+
+
+def _saver(tmp_path, **kwargs) -> SqliteCheckpointSaver:
+    return SqliteCheckpointSaver(path=str(tmp_path / "conversations.sqlite3"), **kwargs)
+
+
+def _graph(checkpointer):
+    # answers every question with the number of messages seen so far
+    def answer(state: MessagesState):
+        return {"messages": [AIMessage(content=f"seen {len(state['messages'])}")]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("answer", answer)
+    builder.add_edge(START, "answer")
+    builder.add_edge("answer", END)
+
+    return builder.compile(checkpointer=checkpointer)
+
+
+def _thread(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _put(saver: SqliteCheckpointSaver, thread_id: str, messages: list = ()):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": list(messages)}
+
+    return saver.put(
+        {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}},
+        checkpoint,
+        {"source": "input", "step": 0, "writes": {}, "parents": {}},
+        {},
+    )
+
+
+def test_conversation_survives_restart(tmp_path):
+    graph = _graph(_saver(tmp_path))
+    graph.invoke({"messages": [HumanMessage(content="first")]}, _thread("user"))
+
+    # a new saver on the same file, as after a restart
+    graph = _graph(_saver(tmp_path))
+    state = graph.get_state(_thread("user"))
+    assert [message.content for message in state.values["messages"]] == [
+        "first",
+        "seen 1",
+    ]
+
+    result = graph.invoke(
+        {"messages": [HumanMessage(content="second")]}, _thread("user")
+    )
+    assert result["messages"][-1].content == "seen 3"
+
+
+def test_stored_messages_are_trimmed_to_a_human_message(tmp_path):
+    saver = _saver(tmp_path, max_messages=5)
+    messages = []
+    for turn in range(10):
+        messages += [
+            HumanMessage(content=f"question {turn}"),
+            AIMessage(content=f"answer {turn}"),
+        ]
+    _put(saver, "user", messages)
+
+    # read back from SQLite, not from the hot tier
+    stored = _saver(tmp_path).get_tuple(_thread("user"))
+    stored_messages = stored.checkpoint["channel_values"]["messages"]
+
+    assert len(stored_messages) <= 5
+    assert stored_messages[0].type == "human"
+    assert stored_messages[-1].content == "answer 9"
+
+
+def test_idle_threads_are_deleted(tmp_path, monkeypatch):
+    saver = _saver(tmp_path, idle_ttl_seconds=3600)
+    now = time.time()
+
+    monkeypatch.setattr(time, "time", lambda: now)
+    _put(saver, "idle")
+
+    # a write two hours later sweeps the thread idle since
+    monkeypatch.setattr(time, "time", lambda: now + 7200)
+    _put(saver, "active")
+
+    assert saver.get_tuple(_thread("idle")) is None
+    assert saver.get_tuple(_thread("active")) is not None
+    assert saver.stats() == {"threads": 1, "hot_threads": 1}
+
+
+def test_pending_writes_are_returned_with_their_checkpoint(tmp_path):
+    saver = _saver(tmp_path)
+    config = _put(saver, "user")
+    saver.put_writes(config, [("messages", "first")], task_id="task")
+
+    checkpoint_tuple = saver.get_tuple(_thread("user"))
+    saver.put_writes(config, [("messages", "second")], task_id="other")
+
+    assert checkpoint_tuple.pending_writes == [("task", "messages", "first")]
+    assert len(saver.get_tuple(_thread("user")).pending_writes) == 2
@@ -0,0 +1,69 @@
+from common.lexical_index import LexicalIndex, tokenize
+
+
+def _index(tmp_path) -> LexicalIndex:
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    index.add(
+        ["retriever", "loader", "config"],
+        [
+            "The DocumentRetriever searches the vector store for a query.",
+            "load_pdf_with_tables extracts text and tables from a PDF file.",
+            "Settings are read from environment variables with a nested delimiter.",
+        ],
+    )
+    return index
+
+
+def test_identifiers_are_split_into_their_parts():
+    assert tokenize("DocumentRetriever load_pdf HTTPServer") == [
+        "documentretriever",
+        "document",
+        "retriever",
+        "load_pdf",
+        "load",
+        "pdf",
+        "httpserver",
+        "http",
+        "server",
+    ]
+
+
+def test_search_ranks_the_matching_chunk_first(tmp_path):
+    index = _index(tmp_path)
+
+    assert index.search("tables in a PDF", k=1)[0][0] == "loader"
+    assert index.search("environment variables", k=3)[0][0] == "config"
+    assert index.search("nothing matches", k=3) == []
+
+
+def test_camel_case_parts_match(tmp_path):
+    index = _index(tmp_path)
+
+    # the whole identifier and each of its parts find the chunk
+    for query in ["DocumentRetriever", "retriever", "document"]:
+        assert index.search(query, k=1)[0][0] == "retriever"
+
+
+def test_deleted_chunks_are_not_returned(tmp_path):
+    index = _index(tmp_path)
+    index.delete(["loader"])
+
+    assert index.count() == 2
+    assert index.search("tables PDF", k=3) == []
+
+
+def test_readding_a_chunk_replaces_it(tmp_path):
+    index = _index(tmp_path)
+    index.add(["loader"], ["load_text_file reads a plain text file."])
+
+    assert index.count() == 3
+    assert index.search("tables", k=3) == []
+    assert index.search("plain text", k=1)[0][0] == "loader"
+
+
+def test_index_persists_across_instances(tmp_path):
+    _index(tmp_path)
+
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    assert index.count() == 3
+    assert index.search("vector store", k=1)[0][0] == "retriever"
@@ -0,0 +1,52 @@
+from common.retrieval_cache import RetrievalCache
+
+
+def test_equivalent_queries_share_a_key():
+    assert RetrievalCache.key("docs", "  What is   RAG? ", 4) == RetrievalCache.key(
+        "docs", "what is rag?", 4
+    )
+    assert RetrievalCache.key("docs", "what is rag?", 4) != RetrievalCache.key(
+        "docs", "what is rag?", 4, {"source": "a.pdf"}
+    )
+
+
+def test_result_of_an_older_generation_is_not_returned():
+    cache = RetrievalCache(max_entries=10)
+    key = RetrievalCache.key("docs", "what is rag?", 4)
+    cache.put(key, 1, ["chunk"])
+
+    assert cache.get(key, 1) == ["chunk"]
+    # the collection changed since the search
+    assert cache.get(key, 2) is None
+    # the stale entry is gone, even for its own generation
+    assert cache.get(key, 1) is None
+    assert cache.stats()["stale"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_generation_of_a_federated_search_covers_every_collection():
+    cache = RetrievalCache(max_entries=10)
+    key = ("federated", "what is rag?")
+    cache.put(key, (1, 1), ["chunk"])
+
+    assert cache.get(key, (1, 2)) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RetrievalCache(max_entries=2)
+    cache.put("a", 0, ["a"])
+    cache.put("b", 0, ["b"])
+    cache.get("a", 0)
+    cache.put("c", 0, ["c"])
+
+    assert cache.get("b", 0) is None
+    assert cache.get("a", 0) == ["a"]
+    assert cache.get("c", 0) == ["c"]
+
+
+def test_returned_documents_are_a_copy():
+    cache = RetrievalCache(max_entries=10)
+    cache.put("a", 0, ["chunk"])
+    cache.get("a", 0).append("other")
+
+    assert cache.get("a", 0) == ["chunk"]
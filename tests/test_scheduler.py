@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from common.admission import AdmissionRejected
+from common.scheduler import FairScheduler
+
+
+def _scheduler(**kwargs) -> FairScheduler:
+    settings = {
+        "max_concurrent": 1,
+        "per_user_concurrency": 1,
+        "max_queued_per_user": 10,
+        "priority_weights": {"interactive": 4.0, "batch": 1.0},
+    }
+    settings.update(kwargs)
+    return FairScheduler(**settings)
+
+
+async def _run_all(scheduler: FairScheduler, requests: list) -> list:
+    """
+    Queue the requests behind a running one and return the order they ran in.
+    """
+    order = []
+    release = asyncio.Event()
+
+    async def request(user_id: str, priority: str, name: str, wait: bool = False):
+        async with scheduler.slot(user_id, priority):
+            order.append(name)
+            if wait:
+                await release.wait()
+
+    blocker = asyncio.create_task(request("blocker", "interactive", "blocker", True))
+    await asyncio.sleep(0)
+
+    tasks = []
+    for user_id, priority, name in requests:
+        tasks.append(asyncio.create_task(request(user_id, priority, name)))
+        await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.gather(blocker, *tasks)
+
+    return order[1:]
+
+
+def test_users_are_served_in_turn():
+    scheduler = _scheduler()
+    requests = [("alice", "interactive", f"alice {n}") for n in range(3)]
+    requests += [("bob", "interactive", f"bob {n}") for n in range(3)]
+
+    order = asyncio.run(_run_all(scheduler, requests))
+
+    # bob arrived last but does not wait behind all of alice's requests
+    assert order == ["alice 0", "bob 0", "alice 1", "bob 1", "alice 2", "bob 2"]
+
+
+def test_interactive_requests_overtake_batch_requests():
+    scheduler = _scheduler()
+    requests = [("alice", "batch", f"batch {n}") for n in range(2)]
+    requests += [("bob", "interactive", f"interactive {n}") for n in range(4)]
+
+    order = asyncio.run(_run_all(scheduler, requests))
+
+    assert order.index("interactive 3") < order.index("batch 1")
+
+
+def test_a_user_never_runs_more_than_the_cap():
+    async def scenario():
+        scheduler = _scheduler(max_concurrent=4, per_user_concurrency=2)
+        running = {"alice": 0, "bob": 0}
+        peak = {"alice": 0, "bob": 0}
+
+        async def request(user_id: str):
+            async with scheduler.slot(user_id):
+                running[user_id] += 1
+                peak[user_id] = max(peak[user_id], running[user_id])
+                await asyncio.sleep(0.01)
+                running[user_id] -= 1
+
+        await asyncio.gather(
+            *(request(user_id) for user_id in ["alice"] * 5 + ["bob"] * 2)
+        )
+        return scheduler, peak
+
+    scheduler, peak = asyncio.run(scenario())
+
+    assert peak == {"alice": 2, "bob": 2}
+    assert scheduler.stats()["running"] == 0
+    assert not scheduler.user_running and not scheduler.user_queued
+
+
+def test_full_user_queue_is_rejected():
+    async def scenario():
+        scheduler = _scheduler(max_queued_per_user=1)
+        release = asyncio.Event()
+
+        async def request(user_id: str):
+            async with scheduler.slot(user_id):
+                await release.wait()
+
+        running = asyncio.create_task(request("alice"))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(request("alice"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected):
+            scheduler.check("alice")
+        # other users still get in
+        scheduler.check("bob")
+
+        release.set()
+        await asyncio.gather(running, waiting)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_cancelled_request_leaves_the_queue():
+    async def scenario():
+        scheduler = _scheduler()
+        release = asyncio.Event()
+
+        async def request(user_id: str):
+            async with scheduler.slot(user_id):
+                await release.wait()
+
+        running = asyncio.create_task(request("alice"))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(request("bob"))
+        await asyncio.sleep(0)
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert "bob" not in scheduler.user_queued
+
+        release.set()
+        await running
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert scheduler.stats()["running"] == 0
+    assert scheduler.stats()["interactive"]["queued"] == 0
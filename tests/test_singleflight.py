@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from common.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flights.do("question", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("question", work))
+        await asyncio.sleep(0)
+
+        release.set()
+        return flights, calls, await asyncio.gather(leader, follower)
+
+    flights, calls, results = asyncio.run(scenario())
+
+    assert calls == 1
+    assert results == ["answer", "answer"]
+    assert flights.stats()["leaders"] == 1
+    assert flights.stats()["followers"] == 1
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_followers_receive_the_error_of_the_run():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            raise ValueError("backend down")
+
+        leader = asyncio.create_task(flights.do("question", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("question", work))
+        await asyncio.sleep(0)
+
+        release.set()
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert [str(result) for result in results] == ["backend down"] * 2
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_leader_does_not_cancel_the_run():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flights.do("question", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("question", work))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == "answer"
+
+
+def test_late_subscriber_replays_the_stream():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+        second_half = asyncio.Event()
+
+        async def chunks():
+            nonlocal calls
+            calls += 1
+            yield "a"
+            yield "b"
+            await second_half.wait()
+            yield "c"
+
+        async def collect():
+            return [chunk async for chunk in flights.stream("question", chunks)]
+
+        leader = asyncio.create_task(collect())
+        # let the first chunks be produced before the follower subscribes
+        for _ in range(5):
+            await asyncio.sleep(0)
+        follower = asyncio.create_task(collect())
+        await asyncio.sleep(0)
+
+        second_half.set()
+        return flights, calls, await asyncio.gather(leader, follower)
+
+    flights, calls, results = asyncio.run(scenario())
+
+    assert calls == 1
+    assert results == [["a", "b", "c"], ["a", "b", "c"]]
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_stream_subscribers_receive_the_error_after_the_chunks():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def chunks():
+            yield "a"
+            await release.wait()
+            raise ValueError("backend down")
+
+        async def collect():
+            received = []
+            with pytest.raises(ValueError):
+                async for chunk in flights.stream("question", chunks):
+                    received.append(chunk)
+            return received
+
+        leader = asyncio.create_task(collect())
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(collect())
+        await asyncio.sleep(0)
+
+        release.set()
+        return await asyncio.gather(leader, follower)
+
+    assert asyncio.run(scenario()) == [["a"], ["a"]]
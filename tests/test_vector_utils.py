@@ -0,0 +1,33 @@
+from common.vector_utils import maximal_marginal_relevance
+
+# two near duplicates close to the query, and a different but still relevant one
+query = [1.0, 0.0]
+candidates = [[1.0, 0.05], [1.0, 0.06], [0.6, 0.8]]
+
+
+def test_pure_relevance_keeps_the_similarity_order():
+    assert maximal_marginal_relevance(query, candidates, k=3, lambda_mult=1.0) == [
+        0,
+        1,
+        2,
+    ]
+
+
+def test_diversity_skips_near_duplicates():
+    assert maximal_marginal_relevance(query, candidates, k=2, lambda_mult=0.3) == [
+        0,
+        2,
+    ]
+
+
+def test_relevance_scores_override_the_query_similarity():
+    selected = maximal_marginal_relevance(
+        query, candidates, k=1, lambda_mult=1.0, relevance=[0.1, 0.2, 0.9]
+    )
+
+    assert selected == [2]
+
+
+def test_k_beyond_the_candidates_selects_them_all():
+    assert sorted(maximal_marginal_relevance(query, candidates, k=10)) == [0, 1, 2]
+    assert maximal_marginal_relevance(query, [], k=3) == []